@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 
 import argparse
-from lxml import etree as et
 from tei_context_converter import tei_context_converter
 
 """
@@ -77,13 +76,10 @@ def main():
     converter_args['ignored_app_types'] = ignored_app_types
     #Initialize the converter with these parameters:
     converter = tei_context_converter(**converter_args)
-    #Parse the input XML document:
-    input_xml = et.parse(input_addr)
-    #Convert the input and write to output:
-    latex = converter.to_context(input_xml)
-    #Then write it to the output address:
-    output_latex = open(output_addr, 'w', encoding='utf-8')
-    output_latex.write(latex)
+    #Parse the input XML document and write the converted fragments to output as they are produced,
+    #so the full ConTeXt script for a book is never accumulated in memory:
+    output_latex = open(output_addr, 'w', encoding='utf-8', buffering=1<<20)
+    converter.to_context_stream(input_addr, output_latex)
     output_latex.close()
     exit(0)
 
@@ -2,11 +2,25 @@
 
 from lxml import etree as et
 from copy import deepcopy
+from itertools import islice
 import json
+import re
 import collatex as cx
 from tei_normalizer import tei_normalizer
 from tei_segmenter import tei_segmenter
 
+"""
+Module-level namespace constants, shared by all xpath calls and tag comparisons.
+"""
+TEI_NS_DICT = {'tei': 'http://www.tei-c.org/ns/1.0'}
+TEI_PREFIX = '{http://www.tei-c.org/ns/1.0}'
+
+"""
+Regular expression and Dictionary for unescaping the XML markup escaped in CollateX's TEI output.
+"""
+UNESCAPE_RE = re.compile('&lt;|&gt;|&quot;')
+UNESCAPE_DICT = {'&lt;': '<', '&gt;': '>', '&quot;': '"'}
+
 """
 Class for collating TEI XML transcriptions of Hebrew text.
 """
@@ -33,8 +47,9 @@ class tei_collator:
     Given an unnormalized TEI XML representing a single witness, returns a String representing its name.
     """
     def get_witness_name(self, xml):
-        #The name is located in the second <title/> element:
-        title = xml.xpath('//tei:title', namespaces={'tei': self.tei_ns})[1]
+        #The name is located in the second <title/> element;
+        #iterate with a short-circuit rather than collecting every <title/> element in the document:
+        title = next(islice(xml.iter(TEI_PREFIX + 'title'), 1, 2))
         wit_n = title.get('n') if title.get('n') is not None else title.text
         return wit_n
     """
@@ -43,7 +58,7 @@ class tei_collator:
     def get_rdg_types(self, xml):
         rdg_types = []
         distinct_rdg_types = set()
-        rdgs = xml.xpath('//tei:rdg', namespaces={'tei': self.tei_ns})
+        rdgs = xml.xpath('//tei:rdg', namespaces=TEI_NS_DICT)
         for rdg in rdgs:
             #Skip any readings that do not have a type:
             if rdg.get('type') is None:
@@ -61,9 +76,9 @@ class tei_collator:
     def get_tokens_by_div(self, t_xml, n_xml):
         tokens_by_div = {}
         #Iterate through every child of the <body/> element (normalization should flatten these to the same level):
-        t_body = t_xml.xpath('//tei:body', namespaces={'tei': 'http://www.tei-c.org/ns/1.0'})[0]
+        t_body = t_xml.xpath('//tei:body', namespaces=TEI_NS_DICT)[0]
         t_elements = t_body.getchildren()
-        n_body = n_xml.xpath('//tei:body', namespaces={'tei': 'http://www.tei-c.org/ns/1.0'})[0]
+        n_body = n_xml.xpath('//tei:body', namespaces=TEI_NS_DICT)[0]
         n_elements = n_body.getchildren()
         div_n = None
         tokens = []
@@ -71,7 +86,7 @@ class tei_collator:
             t_element = t_elements[i]
             n_element = n_elements[i]
             #Add the latest list of tokens to the Dictionary and update the current div index if this is a divider at the appropriate level:
-            if t_element.tag.replace('{%s}' % self.tei_ns, '') == 'milestone':
+            if t_element.tag.replace(TEI_PREFIX, '') == 'milestone':
                 if t_element.get('unit') is not None and t_element.get('unit') in [self.level, 'incipit' ,'explicit'] and t_element.get('n') is not None:
                     if div_n is not None:
                         tokens_by_div[div_n] = tokens.copy()
@@ -157,9 +172,9 @@ class tei_collator:
     """
     def collate(self):
         #Initialize this collator's XML tree as an empty TEI element:
-        self.collation_xml = et.Element('{%s}TEI' % self.tei_ns, nsmap={None: self.tei_ns, 'xml': self.xml_ns})
+        self.collation_xml = et.Element(TEI_PREFIX + 'TEI', nsmap={None: self.tei_ns, 'xml': self.xml_ns})
         #Perform the collation in "chunks" at the specified level of textual division:
-        divs = self.lemma_xml.xpath('//tei:milestone[@unit=\'%s\' or @unit=\'incipit\' or @unit=\'explicit\']' % self.level, namespaces={'tei': self.tei_ns})
+        divs = self.lemma_xml.xpath('//tei:milestone[@unit=\'%s\' or @unit=\'incipit\' or @unit=\'explicit\']' % self.level, namespaces=TEI_NS_DICT)
         for div in divs:
             #Skip any textual divisions without indices:
             if div.get('n') is None:
@@ -177,8 +192,8 @@ class tei_collator:
             collation = json.loads(json.dumps(collation))
             #Now use CollateX to collate:
             cx_out = cx.collate(collation, segmentation=False, output='tei')
-            #Unescape the escaped < and > characters:
-            cx_out = cx_out.replace('&lt;', '<').replace('&gt;', '>').replace('&quot;', '"')
+            #Unescape the escaped < and > characters in a single pass over the output:
+            cx_out = UNESCAPE_RE.sub(lambda match: UNESCAPE_DICT[match.group(0)], cx_out)
             #Parse the output XML:
             apparatus = et.XML(cx_out)
             #Then add each of its children to this collator's collation XML:
@@ -188,7 +203,7 @@ class tei_collator:
         extant_witnesses = []
         for child in self.collation_xml.getchildren():
             #If this element is a textual division at the specified grouping level, then populate a List of witnesses extant at it:
-            if child.tag.replace('{%s}' % self.tei_ns, '') == 'milestone' and child.get('unit') is not None and child.get('unit') in [self.level, 'incipit', 'explicit'] and child.get('n') is not None:
+            if child.tag.replace(TEI_PREFIX, '') == 'milestone' and child.get('unit') is not None and child.get('unit') in [self.level, 'incipit', 'explicit'] and child.get('n') is not None:
                 div_n = child.get('n')
                 extant_witnesses = []
                 for witness in self.witnesses:
@@ -197,16 +212,16 @@ class tei_collator:
                         extant_witnesses.append(witness)
                 continue
             #If this element is an apparatus, then check if all extant witnesses are covered by its readings:
-            if child.tag.replace('{%s}' % self.tei_ns, '') == 'app':
+            if child.tag.replace(TEI_PREFIX, '') == 'app':
                 uncovered_witnesses = set(extant_witnesses)
-                for rdg in child.xpath('.//tei:rdg', namespaces={'tei': self.tei_ns}):
+                for rdg in child.xpath('.//tei:rdg', namespaces=TEI_NS_DICT):
                     for wit_ref in rdg.get('wit').split():
                         witness = wit_ref.replace('#', '')
                         uncovered_witnesses.remove(witness)
                 if len(uncovered_witnesses) == 0:
                     continue
                 #If not all witnesses are covered, then add an empty reading supported by them:
-                omit_rdg = et.Element('{%s}rdg' % self.tei_ns)
+                omit_rdg = et.Element(TEI_PREFIX + 'rdg')
                 omit_rdg_wits = []
                 for witness in self.witnesses:
                     if witness in uncovered_witnesses:
@@ -226,13 +241,13 @@ class tei_collator:
     """
     def augment_lemma(self):
         #Get the lemma XML tree's <sourceDesc/> element:
-        sourceDesc = self.lemma_xml.xpath('//tei:sourceDesc', namespaces={'tei': self.tei_ns})[0]
+        sourceDesc = self.lemma_xml.xpath('//tei:sourceDesc', namespaces=TEI_NS_DICT)[0]
         #Add a witness list under it:
-        listWit = et.Element('{%s}listWit' % self.tei_ns)
+        listWit = et.Element(TEI_PREFIX + 'listWit')
         sourceDesc.append(listWit)
         #Under this, add a <witness/> element for each witness:
         for wit in self.witnesses:
-            witness = et.Element('{%s}witness' % self.tei_ns)
+            witness = et.Element(TEI_PREFIX + 'witness')
             witness.set('{%s}id' % self.xml_ns, wit)
             listWit.append(witness)
         #Segment the lemma, grouping any elements in this collator's ignored tag set with the appropriate substantive elements:
@@ -243,16 +258,16 @@ class tei_collator:
         segment_type = '' #the tag of the substantive element in the current segment:
         segment_n = '' #the index of the substantive element in the current segment:
         for child in self.collation_xml.getchildren():
-            raw_tag = child.tag.replace('{%s}' % self.tei_ns, '')
+            raw_tag = child.tag.replace(TEI_PREFIX, '')
             #If the element is an apparatus, then add it to the lemma:
             if raw_tag == 'app':
                 #Add a copy of this apparatus after the segment corresponding to the last substantive element encountered or the latest apparatus added:
                 app = deepcopy(child)
                 if segment_type == 'app':
-                    last_app = self.lemma_xml.xpath('//tei:app', namespaces={'tei': self.tei_ns})[-1]
+                    last_app = self.lemma_xml.xpath('//tei:app', namespaces=TEI_NS_DICT)[-1]
                     last_app.addnext(app)
                 else:
-                    last_seg = self.lemma_xml.xpath('//tei:seg[@type=\'%s\' and @n=\'%s\']' % (segment_type, segment_n), namespaces={'tei': self.tei_ns})[0]
+                    last_seg = self.lemma_xml.xpath('//tei:seg[@type=\'%s\' and @n=\'%s\']' % (segment_type, segment_n), namespaces=TEI_NS_DICT)[0]
                     last_seg.addnext(app)
                 #Add the tag and index of this apparatus to the Dictionary:
                 if raw_tag not in substantive_indices:
@@ -264,13 +279,13 @@ class tei_collator:
                 #Find the lemma reading:
                 lemma_rdg = None
                 lemma_ref = '#' + self.lemma
-                for rdg in app.xpath('.//tei:rdg', namespaces={'tei': self.tei_ns}):
+                for rdg in app.xpath('.//tei:rdg', namespaces=TEI_NS_DICT):
                     if lemma_ref in rdg.get('wit').split():
                         lemma_rdg = rdg
                         break
                 #Then proceed through every substantive element in the lemma reading, adding their tags and indices in the Dictionary:
                 for lem_rdg_child in lemma_rdg.getchildren():
-                    lem_rdg_child_raw_tag = lem_rdg_child.tag.replace('{%s}' % self.tei_ns, '')
+                    lem_rdg_child_raw_tag = lem_rdg_child.tag.replace(TEI_PREFIX, '')
                     if lem_rdg_child_raw_tag not in substantive_indices:
                         substantive_indices[lem_rdg_child_raw_tag] = 0
                     else:
@@ -287,12 +302,12 @@ class tei_collator:
             segment_type = raw_tag
             segment_n = str(substantive_indices[raw_tag])
         #Now, loop through the <app/> elements added to the lemma XML, adding <lem/> reading elements to them and populating them:
-        for app in self.lemma_xml.xpath('//tei:app', namespaces={'tei': self.tei_ns}):
-            lem = et.Element('{%s}lem' % self.tei_ns)
+        for app in self.lemma_xml.xpath('//tei:app', namespaces=TEI_NS_DICT):
+            lem = et.Element(TEI_PREFIX + 'lem')
             #Find the lemma reading:
             lemma_rdg = None
             lemma_ref = '#' + self.lemma
-            for rdg in app.xpath('.//tei:rdg', namespaces={'tei': self.tei_ns}):
+            for rdg in app.xpath('.//tei:rdg', namespaces=TEI_NS_DICT):
                 if lemma_ref in rdg.get('wit').split():
                     lemma_rdg = rdg
                     break
@@ -305,7 +320,7 @@ class tei_collator:
                 n_remaining_children = 0
             while n_remaining_children > 0:
                 #Skip any non-segment elements (e.g., apparatus elements that have been added):
-                if child.tag.replace('{%s}' % self.tei_ns, '') != 'seg':
+                if child.tag.replace(TEI_PREFIX, '') != 'seg':
                     child = child.getnext()
                     continue
                 #Move this segment's contents under the <lem/> elements:
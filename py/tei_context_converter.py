@@ -1,8 +1,75 @@
 #!/usr/bin/env python3
 
 import argparse
+import re
+from concurrent.futures import ProcessPoolExecutor
 from lxml import etree as et
 
+"""
+Module-level namespace constant and Clark-notation tag strings, built with lxml's own QName facility.
+An element's .tag is exactly QName(ns, name).text, so comparing against these constants
+is a plain string equality with no per-element namespace math.
+"""
+TEI_NS = 'http://www.tei-c.org/ns/1.0'
+W_TAG = et.QName(TEI_NS, 'w').text
+APP_TAG = et.QName(TEI_NS, 'app').text
+MILESTONE_TAG = et.QName(TEI_NS, 'milestone').text
+PB_TAG = et.QName(TEI_NS, 'pb').text
+LB_TAG = et.QName(TEI_NS, 'lb').text
+SPACE_TAG = et.QName(TEI_NS, 'space').text
+LEM_TAG = et.QName(TEI_NS, 'lem').text
+RDG_TAG = et.QName(TEI_NS, 'rdg').text
+BODY_TAG = et.QName(TEI_NS, 'body').text
+TEXT_TAG = et.QName(TEI_NS, 'text').text
+
+"""
+Constant ConTeXt fragments for elements whose output does not depend on their content.
+"""
+PB_STR = '\n\\page\n'
+OPEN_SECTION_STR = '\\OpenSection '
+CLOSED_SECTION_STR = '\\ClosedSection '
+RDG_OPEN_SECTION_STR = '\\RdgOpenSection '
+RDG_CLOSED_SECTION_STR = '\\RdgClosedSection '
+
+"""
+Static preamble and postamble emitted around the formatted body.
+"""
+PREAMBLE = '\\environment ../sty/sr-style\n\\startcomponent\n\\product ../main/main\n\\starttext\n%\\startbodymatter %uncomment to trigger appropriate conditional formatting for standalone document\n'
+POSTAMBLE = '%\\stopbodymatter\n\\stoptext\n\\stopcomponent'
+
+"""
+Iterates over an element's children with one child of lookahead, yielding (child, is_last) pairs,
+so that formatters can recognize the last child without indexing into the element.
+"""
+def with_last(xml):
+    children = iter(xml)
+    prev = next(children, None)
+    if prev is None:
+        return
+    for child in children:
+        yield prev, False
+        prev = child
+    yield prev, True
+
+"""
+Converter instance used by the worker processes of the parallel conversion path;
+each worker initializes its own copy once and reuses it (and its caches) for every apparatus it formats.
+"""
+worker_converter = None
+
+"""
+Initializes the per-process converter from the parent converter's parameters.
+"""
+def init_app_worker(converter_args):
+    global worker_converter
+    worker_converter = tei_context_converter(**converter_args)
+
+"""
+Parses a serialized <app/> element and formats it with the per-process converter.
+"""
+def format_app_bytes(app_bytes):
+    return worker_converter.format_app(et.fromstring(app_bytes))
+
 """
 Class for converting a transcription (including collation data) in TEI XML format to ConTeXt format.
 """
@@ -11,24 +78,59 @@ class tei_context_converter:
     XML namespaces
     """
     xml_ns = 'http://www.w3.org/XML/1998/namespace'
-    tei_ns = 'http://www.tei-c.org/ns/1.0'
+    tei_ns = TEI_NS
     
     def __init__(self, **kwargs):
         #Populate a String referring to the book's filename base:
         self.filebase = kwargs['filebase'] if 'filebase' in kwargs else ''
         #Populate a Dictionary of witness sigla, keyed by witness references (e.g., '#WLC'):
         self.wit_sigla = kwargs['wit_sigla'] if 'wit_sigla' in kwargs else {}
+        #Build a translation table for any single-character witness references,
+        #which str.translate can replace in one pass at C speed:
+        single_wit_refs = {wit_ref: self.wit_sigla[wit_ref] for wit_ref in self.wit_sigla if len(wit_ref) == 1}
+        self.wit_sigla_table = str.maketrans(single_wit_refs) if len(single_wit_refs) > 0 else None
+        #Compile a single alternation pattern over the remaining witness references (longest first,
+        #so that references sharing a prefix match correctly); each reading's witness list can then be
+        #rewritten in one scan instead of one replace pass per siglum:
+        wit_refs = sorted((wit_ref for wit_ref in self.wit_sigla if len(wit_ref) > 1), key=len, reverse=True)
+        self.wit_sigla_re = re.compile('|'.join(map(re.escape, wit_refs))) if len(wit_refs) > 0 else None
         #Populate a Dictionary of book titles, keyed by book numbers (e.g., 'B01'):
         self.book_titles = kwargs['book_titles'] if 'book_titles' in kwargs else {}
         #Populate a Set of ignored apparatus types:
         self.ignored_app_types = kwargs['ignored_app_types'] if 'ignored_app_types' in kwargs else set()
+        #Build dispatch Dictionaries of bound handler methods, keyed by Clark-notation tag or milestone unit,
+        #so each child element is routed with a single Dictionary lookup instead of a chain of comparisons:
+        self.body_handlers = {
+            APP_TAG: self.format_app,
+            MILESTONE_TAG: self.format_body_milestone,
+            PB_TAG: self.format_pb,
+            LB_TAG: self.format_body_lb,
+            SPACE_TAG: self.format_body_space
+        }
+        self.body_milestone_handlers = {
+            'book': self.format_body_milestone_book,
+            'chapter': self.format_body_milestone_chapter,
+            'verse': self.format_body_milestone_verse
+        }
+        self.lem_handlers = {
+            LB_TAG: self.format_body_lb,
+            SPACE_TAG: self.format_body_space
+        }
+        self.rdg_handlers = {
+            LB_TAG: self.format_rdg_lb,
+            SPACE_TAG: self.format_rdg_space
+        }
+        #Initialize caches of formatted lemma and reading content, keyed by structural subtree keys;
+        #many readings in a collation are structurally identical apart from their witness lists,
+        #so their content only has to be formatted once:
+        self.lem_cache = {}
+        self.rdg_cache = {}
         return
     """
     Converts a <pb/> element in the body to ConTeXt format.
     """
     def format_pb(self, xml):
-        context = '\n\\page\n'
-        return context
+        return PB_STR
     """
     Converts a <milestone unit="book"/> element in the body to ConTeXt format.
     """
@@ -39,7 +141,7 @@ class tei_context_converter:
         book_title = ''
         if n is not None and n in self.book_titles:
             book_title = self.book_titles[n]
-            context += '\\startBook[title={%s}]\n' % (book_title)
+            context += '\\startBook[title={' + book_title + '}]\n'
         #Start the pagecolumns environment:
         context += '\\startpagecolumns[hebrew]\n'
         return context
@@ -50,10 +152,11 @@ class tei_context_converter:
         context = ''
         #Get the book's title via a lookup in the provided Dictionary:
         n = xml.get('n')
-        chapter_title = ''
-        if n is not None and 'K' in n:
-            chapter_title = n.split('K')[-1]
-            context += '\n\\Chapter{%s}' % chapter_title
+        if n is not None:
+            #Partition from the right in a single scan, instead of testing for containment and then splitting:
+            head, found, chapter_title = n.rpartition('K')
+            if found:
+                context += '\n\\Chapter{' + chapter_title + '}'
         return context
     """
     Converts a <milestone unit="verse"/> element in the body to ConTeXt format.
@@ -62,10 +165,11 @@ class tei_context_converter:
         context = ''
         #Get the book's title via a lookup in the provided Dictionary:
         n = xml.get('n')
-        verse_title = ''
-        if n is not None and 'V' in n:
-            verse_title = n.split('V')[-1]
-            context += '\n\\Verse{%s}' % verse_title
+        if n is not None:
+            #Partition from the right in a single scan, instead of testing for containment and then splitting:
+            head, found, verse_title = n.rpartition('V')
+            if found:
+                context += '\n\\Verse{' + verse_title + '}'
         return context
     """
     Converts a <milestone unit="verse"/> element in the body that is the last child of a lemma to ConTeXt format.
@@ -74,73 +178,97 @@ class tei_context_converter:
         context = ''
         #Get the book's title via a lookup in the provided Dictionary:
         n = xml.get('n')
-        verse_title = ''
-        if n is not None and 'V' in n:
-            verse_title = n.split('V')[-1]
-            context += '\n\\Verse{%s}\\nospace' % verse_title
+        if n is not None:
+            #Partition from the right in a single scan, instead of testing for containment and then splitting:
+            head, found, verse_title = n.rpartition('V')
+            if found:
+                context += '\n\\Verse{' + verse_title + '}\\nospace'
         return context
     """
-    Converts an <lb type="open"/> element in the body to ConTeXt format.
+    Converts a <milestone/> element in the body to ConTeXt format, dispatching on its unit.
     """
-    def format_body_lb_open(self, xml):
-        context = ''
-        context += '\\OpenSection '
-        return context
+    def format_body_milestone(self, xml):
+        handler = self.body_milestone_handlers.get(xml.get('unit'))
+        return handler(xml) if handler is not None else ''
     """
-    Converts a <space type="closed"/> element in the body to ConTeXt format.
+    Converts an <lb/> element in the body to ConTeXt format, dispatching on its type.
     """
-    def format_body_space_closed(self, xml):
-        context = ''
-        context += '\\ClosedSection '
-        return context
+    def format_body_lb(self, xml):
+        return OPEN_SECTION_STR if xml.get('type') == 'open' else ''
+    """
+    Converts a <space/> element in the body to ConTeXt format, dispatching on its type.
+    """
+    def format_body_space(self, xml):
+        return CLOSED_SECTION_STR if xml.get('type') == 'closed' else ''
     """
     Converts a <w/> element to ConTeXt format.
     """
     def format_w(self, xml):
-        context = ''
-        context += '%s ' % xml.text
-        return context
+        #Concatenate directly instead of %-formatting, as this method is called once per word:
+        return (xml.text or '') + ' '
     """
     Converts a <w/> element that is the last child of an element to ConTeXt format.
     """
     def format_w_last(self, xml):
-        context = ''
-        context += '%s' % xml.text
-        return context
+        return xml.text or ''
     """
-    Recursively converts a <lem/> element to ConTeXt format.
+    Computes a hashable structural key for a <lem/> or <rdg/> element,
+    covering every property of its children that the formatters below read.
     """
-    def format_lem(self, xml):
-        context = ''
-        #Process the <milestone/>, <lb/>, <space/>, and <w/> elements under this element:
+    def subtree_key(self, xml):
+        key_parts = []
         for child in xml:
-            raw_tag = child.tag.replace('{%s}' % self.tei_ns, '')
-            if raw_tag == 'milestone':
+            #Bind the child's get method once for the three attribute reads:
+            get = child.get
+            key_parts.append((child.tag, child.text, get('unit'), get('type'), get('n')))
+        return tuple(key_parts)
+    """
+    Converts a <lem/> element to ConTeXt format, reusing the cached result for structurally identical lemmata.
+    """
+    def format_lem(self, xml):
+        key = self.subtree_key(xml)
+        cached = self.lem_cache.get(key)
+        if cached is None:
+            cached = self.format_lem_content(xml)
+            self.lem_cache[key] = cached
+        return cached
+    """
+    Recursively converts the content of a <lem/> element to ConTeXt format.
+    """
+    def format_lem_content(self, xml):
+        parts = []
+        #Bind the append method to a local name to avoid an attribute lookup on every child:
+        append = parts.append
+        #Process the <milestone/>, <lb/>, <space/>, and <w/> elements under this element,
+        #iterating with one child of lookahead instead of indexing for the last child:
+        tag = None
+        for child, is_last in with_last(xml):
+            tag = child.tag
+            #Test for words first, as they are by far the most common elements,
+            #and emit their text inline to avoid a method call per word;
+            #the trailing space is appended separately so it can be dropped after the loop:
+            if tag == W_TAG:
+                append(child.text or '')
+                append(' ')
+            elif tag == MILESTONE_TAG:
                 #Proceed based on the unit of the text division:
                 milestone_unit = child.get('unit')
                 if milestone_unit == 'chapter':
-                    context += self.format_body_milestone_chapter(child)
+                    append(self.format_body_milestone_chapter(child))
                 elif milestone_unit == 'verse':
                     #Proceed based on whether this verse is the last child of the lemma:
-                    if child == xml[-1]:
-                        context += self.format_body_milestone_verse_last(child)
+                    if is_last:
+                        append(self.format_body_milestone_verse_last(child))
                     else:
-                        context += self.format_body_milestone_verse(child)
-            elif raw_tag == 'lb':
-                lb_type = child.get('type')
-                if lb_type == 'open':
-                    context += self.format_body_lb_open(child)
-            elif raw_tag == 'space':
-                space_type = child.get('type')
-                if space_type == 'closed':
-                    context += self.format_body_space_closed(child)
-            elif raw_tag == 'w':
-                #Proceed based on whether this word is the last child of the lemma:
-                if child == xml[-1]:
-                    context += self.format_w_last(child)
-                else:
-                    context += self.format_w(child)
-        return context
+                        append(self.format_body_milestone_verse(child))
+            else:
+                handler = self.lem_handlers.get(tag)
+                if handler is not None:
+                    append(handler(child))
+        #If the last child was a word, then drop the trailing space appended for it:
+        if tag == W_TAG:
+            parts.pop()
+        return ''.join(parts)
     """
     Converts a <milestone unit="chapter"/> element in the apparatus to ConTeXt format.
     """
@@ -148,10 +276,11 @@ class tei_context_converter:
         context = ''
         #Get the book's title via a lookup in the provided Dictionary:
         n = xml.get('n')
-        chapter_title = ''
-        if n is not None and 'K' in n:
-            chapter_title = n.split('K')[-1]
-            context += '\\RdgChapter{%s}' % chapter_title
+        if n is not None:
+            #Partition from the right in a single scan, instead of testing for containment and then splitting:
+            head, found, chapter_title = n.rpartition('K')
+            if found:
+                context += '\\RdgChapter{' + chapter_title + '}'
         return context
     """
     Converts a <milestone unit="verse"/> element in the apparatus to ConTeXt format.
@@ -160,10 +289,11 @@ class tei_context_converter:
         context = ''
         #Get the book's title via a lookup in the provided Dictionary:
         n = xml.get('n')
-        verse_title = ''
-        if n is not None and 'V' in n:
-            verse_title = n.split('V')[-1]
-            context += '\\RdgVerse{%s}' % verse_title
+        if n is not None:
+            #Partition from the right in a single scan, instead of testing for containment and then splitting:
+            head, found, verse_title = n.rpartition('V')
+            if found:
+                context += '\\RdgVerse{' + verse_title + '}'
         return context
     """
     Converts a <milestone unit="verse"/> element in the apparatus that is the last child of a variant reading to ConTeXt format.
@@ -172,174 +302,148 @@ class tei_context_converter:
         context = ''
         #Get the book's title via a lookup in the provided Dictionary:
         n = xml.get('n')
-        verse_title = ''
-        if n is not None and 'V' in n:
-            verse_title = n.split('V')[-1]
-            context += '\\RdgVerse{%s}\\nospace' % verse_title
+        if n is not None:
+            #Partition from the right in a single scan, instead of testing for containment and then splitting:
+            head, found, verse_title = n.rpartition('V')
+            if found:
+                context += '\\RdgVerse{' + verse_title + '}\\nospace'
         return context
     """
-    Converts an <lb type="open"/> element in the apparatus to ConTeXt format.
+    Converts an <lb/> element in the apparatus to ConTeXt format, dispatching on its type.
     """
-    def format_rdg_lb_open(self, xml):
-        context = ''
-        context += '\\RdgOpenSection '
-        return context
+    def format_rdg_lb(self, xml):
+        return RDG_OPEN_SECTION_STR if xml.get('type') == 'open' else ''
     """
-    Converts a <space type="closed"/> element in the apparatus to ConTeXt format.
+    Converts a <space/> element in the apparatus to ConTeXt format, dispatching on its type.
     """
-    def format_rdg_space_closed(self, xml):
-        context = ''
-        context += '\\RdgClosedSection '
-        return context
+    def format_rdg_space(self, xml):
+        return RDG_CLOSED_SECTION_STR if xml.get('type') == 'closed' else ''
     """
-    Recursively converts a <rdg/> element to ConTeXt format.
+    Converts a <rdg/> element to ConTeXt format, reusing the cached result for structurally identical content;
+    only the witness list, which varies between otherwise identical readings, is processed per call.
     """
     def format_rdg(self, xml):
-        context = ''
-        #Typeset the witness list of this reading:
+        #Typeset the witness list of this reading, replacing witness references with their sigla in a single pass:
         wit = xml.get('wit')
         wit_context = ''
         if wit is not None:
             wit_context = wit
-            for wit_ref in self.wit_sigla:
-                wit_siglum = self.wit_sigla[wit_ref]
-                wit_context = wit_context.replace(wit_ref, wit_siglum)
+            if self.wit_sigla_table is not None:
+                wit_context = wit_context.translate(self.wit_sigla_table)
+            if self.wit_sigla_re is not None:
+                wit_context = self.wit_sigla_re.sub(lambda match: self.wit_sigla[match.group(0)], wit_context)
+        key = self.subtree_key(xml)
+        cached = self.rdg_cache.get(key)
+        if cached is None:
+            cached = self.format_rdg_content(xml)
+            self.rdg_cache[key] = cached
+        return '\Reading{' + cached + '}{' + wit_context + '}'
+    """
+    Recursively converts the content of a <rdg/> element to ConTeXt format.
+    """
+    def format_rdg_content(self, xml):
         #Process the <milestone/>, <lb/>, <space/>, and <w/> elements under this element:
-        rdg_context = ''
-        for child in xml:
-            raw_tag = child.tag.replace('{%s}' % self.tei_ns, '')
-            if raw_tag == 'milestone':
+        rdg_parts = []
+        #Bind the append method to a local name to avoid an attribute lookup on every child:
+        append = rdg_parts.append
+        #Iterate with one child of lookahead instead of indexing for the last child:
+        tag = None
+        for child, is_last in with_last(xml):
+            tag = child.tag
+            #Test for words first, as they are by far the most common elements,
+            #and emit their text inline to avoid a method call per word;
+            #the trailing space is appended separately so it can be dropped after the loop:
+            if tag == W_TAG:
+                append(child.text or '')
+                append(' ')
+            elif tag == MILESTONE_TAG:
                 #Proceed based on the unit of the text division:
                 milestone_unit = child.get('unit')
                 if milestone_unit == 'chapter':
-                    rdg_context += self.format_rdg_milestone_chapter(child)
+                    append(self.format_rdg_milestone_chapter(child))
                 elif milestone_unit == 'verse':
                     #Proceed based on whether this verse is the last child of the lemma:
-                    if child == xml[-1]:
-                        rdg_context += self.format_rdg_milestone_verse_last(child)
+                    if is_last:
+                        append(self.format_rdg_milestone_verse_last(child))
                     else:
-                        rdg_context += self.format_rdg_milestone_verse(child)
-            elif raw_tag == 'lb':
-                lb_type = child.get('type')
-                if lb_type == 'open':
-                    rdg_context += self.format_rdg_lb_open(child)
-            elif raw_tag == 'space':
-                space_type = child.get('type')
-                if space_type == 'closed':
-                    rdg_context += self.format_rdg_space_closed(child)
-            elif raw_tag == 'w':
-                #Proceed based on whether this word is the last child of the reading:
-                if child == xml[-1]:
-                    rdg_context += self.format_w_last(child)
-                else:
-                    rdg_context += self.format_w(child)
-        context += '\Reading{%s}{%s}' % (rdg_context, wit_context)
-        return context
+                        append(self.format_rdg_milestone_verse(child))
+            else:
+                handler = self.rdg_handlers.get(tag)
+                if handler is not None:
+                    append(handler(child))
+        #If the last child was a word, then drop the trailing space appended for it:
+        if tag == W_TAG:
+            rdg_parts.pop()
+        return ''.join(rdg_parts)
     """
     Recursively converts an <app/> element to ConTeXt format.
     """
     def format_app(self, xml):
-        context = ''
         #Get the type of this apparatus:
         app_type = xml.get('type')
         #If this is an ignored type, then typeset its lemma and nothing else:
         if app_type is None or app_type in self.ignored_app_types:
-            lem_context = ''
+            lem_parts = []
             for child in xml:
-                raw_tag = child.tag.replace('{%s}' % self.tei_ns, '')
-                if raw_tag == 'lem':
-                    lem_context += self.format_lem(child)
-            context += lem_context + ' '
+                if child.tag == LEM_TAG:
+                    lem_parts.append(self.format_lem(child))
+            return ''.join(lem_parts) + ' '
         #Otherwise, typeset its lemma and variant readings separately:
-        else:
-            lem_context = ''
-            rdg_context = ''
-            for child in xml:
-                raw_tag = child.tag.replace('{%s}' % self.tei_ns, '')
-                if raw_tag == 'lem':
-                    lem_context += self.format_lem(child)
-                elif raw_tag == 'rdg':
-                    rdg_context += self.format_rdg(child)
-                    if child == xml[1]:
-                        rdg_context += '\\PrimaryReadingSep'
-                    elif child != xml[-1]:
-                        rdg_context += '\\SecondaryReadingSep'
-            context += '\\App{%s}{%s}{%s} ' % (app_type, lem_context, rdg_context)
-        return context        
+        lem_parts = []
+        rdg_parts = []
+        #Bind the append methods to local names to avoid an attribute lookup on every child:
+        lem_append = lem_parts.append
+        rdg_append = rdg_parts.append
+        #Iterate with one child of lookahead instead of indexing for the first reading and last child:
+        for i, (child, is_last) in enumerate(with_last(xml)):
+            tag = child.tag
+            if tag == LEM_TAG:
+                lem_append(self.format_lem(child))
+            elif tag == RDG_TAG:
+                rdg_append(self.format_rdg(child))
+                if i == 1:
+                    rdg_append('\\PrimaryReadingSep')
+                elif not is_last:
+                    rdg_append('\\SecondaryReadingSep')
+        return '\\App{' + app_type + '}{' + ''.join(lem_parts) + '}{' + ''.join(rdg_parts) + '} '
     """
     Recursively converts a <body/> element to ConTeXt format.
     """
     def format_body(self, xml):
-        context = ''
-        #Process the <milestone/>, <lb/>, <space/>, <w/>, and <app/> elements under this element:
+        parts = []
+        #Bind the append method to a local name to avoid an attribute lookup on every child:
+        append = parts.append
+        #Process the <milestone/>, <lb/>, <space/>, <w/>, and <app/> elements under this element,
+        #tracking the last tag seen instead of indexing for the last child:
+        tag = None
         for child in xml:
-            raw_tag = child.tag.replace('{%s}' % self.tei_ns, '')
-            if raw_tag == 'milestone':
-                #Proceed based on the unit of the text division:
-                milestone_unit = child.get('unit')
-                if milestone_unit == 'book':
-                    context += self.format_body_milestone_book(child)
-                elif milestone_unit == 'chapter':
-                    context += self.format_body_milestone_chapter(child)
-                elif milestone_unit == 'verse':
-                    context += self.format_body_milestone_verse(child)
-            elif raw_tag == 'pb':
-                context += self.format_pb(child)
-            elif raw_tag == 'lb':
-                lb_type = child.get('type')
-                if lb_type == 'open':
-                    context += self.format_body_lb_open(child)
-            elif raw_tag == 'space':
-                space_type = child.get('type')
-                if space_type == 'closed':
-                    context += self.format_body_space_closed(child)
-            elif raw_tag == 'w':
-                #Proceed based on whether this word is the last child of the body:
-                if child == xml[-1]:
-                    context += self.format_w_last(child)
-                else:
-                    context += self.format_w(child)
-            elif raw_tag == 'app':
-                context += self.format_app(child)
+            tag = child.tag
+            #Test for words first, as they are by far the most common elements,
+            #and emit their text inline to avoid a method call per word;
+            #the trailing space is appended separately so it can be dropped after the loop:
+            if tag == W_TAG:
+                append(child.text or '')
+                append(' ')
+            else:
+                handler = self.body_handlers.get(tag)
+                if handler is not None:
+                    append(handler(child))
+        #If the last child was a word, then drop the trailing space appended for it:
+        if tag == W_TAG:
+            parts.pop()
         #Close the pagecolumns environment (it will be opened at the 'book' milestone):
-        context += '\n\\page[no]\n\\stoppagecolumns\n\\stopBook\n'
-        return context
+        append('\n\\page[no]\n\\stoppagecolumns\n\\stopBook\n')
+        return ''.join(parts)
     """
-    Recursively converts a <text/> element to ConTeXt format.
-    """
-    def format_text(self, xml):
-        context = ''
-        #Open the text environment:
-        context += '\\starttext\n'
-        context += '%\\startbodymatter %uncomment to trigger appropriate conditional formatting for standalone document\n'
-        #Process the <front/>, <body/>, and <back/> elements under this element:
-        for child in xml:
-            raw_tag = child.tag.replace('{%s}' % self.tei_ns, '')
-            if raw_tag == 'front':
-                pass #this isn't present for our use case, but leaving it here for future reference
-            elif raw_tag == 'body':
-                context += self.format_body(child)
-            elif raw_tag == 'back':
-                pass #this isn't present for our use case, but leaving it here for future reference
-        #Close the text environment:
-        context += '%\\stopbodymatter\n'
-        context += '\\stoptext\n'
-        return context
-    """
-    Recursively converts a <TEI/> element to ConTeXt format.
+    Converts a <TEI/> element to ConTeXt format.
+    The preamble and postamble around the body are fixed, so the only real work is formatting
+    the <body/> element, which is located directly instead of looping over the wrapper elements.
     """
     def format_tei(self, xml):
-        context = ''
-        context += '\\environment ../sty/sr-style\n'
-        context += '\\startcomponent\n'
-        context += '\\product ../main/main\n'
-        #Process the <text/> element under this element:
-        for child in xml:
-            raw_tag = child.tag.replace('{%s}' % self.tei_ns, '')
-            if raw_tag == 'text':
-                context += self.format_text(child)
-        context += '\\stopcomponent'
-        return context
+        body = xml.find(TEXT_TAG + '/' + BODY_TAG)
+        if body is None:
+            return PREAMBLE + POSTAMBLE
+        return PREAMBLE + self.format_body(body) + POSTAMBLE
     """
     Recursively converts a transcription (including collation data) in TEI XML format to ConTeXt format.
     """
@@ -349,4 +453,100 @@ class tei_context_converter:
         if not et.iselement(xml):
             context += self.format_tei(xml.getroot())
             return context
-        return context
\ No newline at end of file
+        return context
+    """
+    Converts a transcription (including collation data) in TEI XML format to ConTeXt format,
+    formatting the independent <app/> elements across a pool of worker processes.
+    Each apparatus is serialized, formatted in a worker, and the results (which executor.map
+    returns in document order) are spliced back in by a temporary entry in the body dispatch table.
+    Small collations fall back to the serial path, as the pool costs more than it saves there.
+    """
+    def to_context_parallel(self, xml, max_workers=None, min_apps=256):
+        #If the input is an XML tree and not an element, then work with its root element:
+        if not et.iselement(xml):
+            xml = xml.getroot()
+        #Collect the <app/> elements in document order:
+        apps = xml.findall('.//' + APP_TAG)
+        if len(apps) < min_apps:
+            return self.format_tei(xml)
+        converter_args = {}
+        converter_args['filebase'] = self.filebase
+        converter_args['wit_sigla'] = self.wit_sigla
+        converter_args['book_titles'] = self.book_titles
+        converter_args['ignored_app_types'] = self.ignored_app_types
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_app_worker, initargs=(converter_args,)) as executor:
+            app_contexts = iter(list(executor.map(format_app_bytes, (et.tostring(app, with_tail=False) for app in apps), chunksize=256)))
+        #Walk the tree as usual, but have the body's apparatus handler consume the precomputed results:
+        self.body_handlers[APP_TAG] = lambda child: next(app_contexts)
+        try:
+            context = self.format_tei(xml)
+        finally:
+            self.body_handlers[APP_TAG] = self.format_app
+        return context
+    """
+    Converts a transcription (including collation data) in TEI XML format to ConTeXt format in a single streaming pass.
+    The input is parsed incrementally with iterparse, and each formatted fragment is written to the given output file
+    as soon as its element is complete, so memory stays bounded by the size of one apparatus block
+    rather than the whole book; processed elements are cleared and their earlier siblings pruned as we go.
+    """
+    def to_context_stream(self, source, out):
+        #Write the component preamble and open the text environment:
+        out.write(PREAMBLE)
+        #Maintain a small amount of state:
+        #whether we are inside the <body/> element, whether we are inside an <app/> element
+        #(whose children are formatted all at once when the <app/> element ends),
+        #and the last top-level <w/> element seen, which is held back one step
+        #so that it can be formatted without a trailing space if it closes the body:
+        in_body = False
+        in_app = False
+        pending_w = None
+        for event, elem in et.iterparse(source, events=('start', 'end'), huge_tree=True):
+            tag = elem.tag
+            if event == 'start':
+                if tag == BODY_TAG:
+                    in_body = True
+                elif tag == APP_TAG:
+                    in_app = True
+                continue
+            if not in_body:
+                continue
+            if tag == APP_TAG:
+                #Flush any held-back word, then format the completed apparatus subtree:
+                if pending_w is not None:
+                    out.write(self.format_w(pending_w))
+                    pending_w = None
+                out.write(self.format_app(elem))
+                in_app = False
+            elif in_app:
+                #Children of an <app/> element are handled when the <app/> element ends:
+                continue
+            elif tag == W_TAG:
+                #Flush any held-back word and hold this one back in its place:
+                if pending_w is not None:
+                    out.write(self.format_w(pending_w))
+                pending_w = elem
+                continue
+            elif tag == BODY_TAG:
+                #A held-back word is now known to be the last child of the body:
+                if pending_w is not None:
+                    out.write(self.format_w_last(pending_w))
+                    pending_w = None
+                #Close the pagecolumns environment (it will be opened at the 'book' milestone):
+                out.write('\n\\page[no]\n\\stoppagecolumns\n\\stopBook\n')
+                in_body = False
+            else:
+                handler = self.body_handlers.get(tag)
+                if handler is not None:
+                    if pending_w is not None:
+                        out.write(self.format_w(pending_w))
+                        pending_w = None
+                    out.write(handler(elem))
+            #Free the element we just processed along with any earlier siblings still in the tree:
+            elem.clear(keep_tail=True)
+            parent = elem.getparent()
+            if parent is not None:
+                while elem.getprevious() is not None:
+                    del parent[0]
+        #Close the text environment and the component:
+        out.write(POSTAMBLE)
+        return
\ No newline at end of file
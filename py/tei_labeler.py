@@ -23,69 +23,101 @@ class tei_labeler:
         'verse': 'V',
         'w': 'U'
     }
+    """
+    Clark-notation tag strings, precomputed once for tag-filtered iteration
+    """
+    app_tag = '{%s}app' % tei_ns
+    rdg_tag = '{%s}rdg' % tei_ns
+    lem_tag = '{%s}lem' % tei_ns
+    w_tag = '{%s}w' % tei_ns
+    milestone_tag = '{%s}milestone' % tei_ns
     def __init__(self, **params):
         self.div_hierarchy = [] #this List should be populated in top-down order
+        self.div_order = {} #maps each division type to its position in the hierarchy List, for O(1) lookups
         self.div_indices = {} #contains the latest div and word indices
         return
     """
+    Returns a List of the serialization tokens of the given reading element:
+    the text of each child, or its tag if it has no text.
+    """
+    def get_rdg_tokens(self, rdg):
+        rdg_tokens = []
+        for el in rdg:
+            if el.text is None:
+                rdg_tokens.append(el.tag)
+            else:
+                rdg_tokens.append(el.text)
+        return rdg_tokens
+    """
     Adds a 'type' attribute to all <app/> elements in the given collation XML file.
     """
     def add_types(self, xml):
+        #The normalizer is stateless with respect to the apparatus being processed,
+        #so construct it once rather than once per <app/> element:
+        normalizer = tei_normalizer(**{'a': set(['cantillation', 'pointing', 'extraordinaire']), 'p': set(), 'r': None, 't': set()})
         #Proceed for each <app/> element in the XML tree:
-        for app in xml.xpath('//tei:app', namespaces={'tei': self.tei_ns}):
-            normalizer = tei_normalizer(**{'a': set(['cantillation', 'pointing', 'extraordinaire']), 'p': set(), 'r': None, 't': set()})
-            #First, serialize the primary reading at its current level of normalization:
-            primary_rdg = app.xpath('.//tei:rdg', namespaces={'tei': self.tei_ns})[0]
-            primary_rdg_tokens = []
-            for el in primary_rdg:
-                if el.text is None:
-                    primary_rdg_tokens.append(el.tag)
-                else:
-                    primary_rdg_tokens.append(el.text)
+        for app in xml.iter(self.app_tag):
+            #First, serialize the primary reading at its current level of normalization;
+            #the readings are streamed from a single tag-filtered iterator rather than
+            #materializing an XPath result list:
+            rdgs = app.iter(self.rdg_tag)
+            primary_rdg = next(rdgs)
+            primary_rdg_tokens = self.get_rdg_tokens(primary_rdg)
             primary_rdg_serialization = ' '.join(primary_rdg_tokens)
-            #Then get corresponding serializations of the remaining variant readings:
+            #Then get corresponding serializations of the remaining variant readings,
+            #keeping their token counts so the addition and omission checks below
+            #don't have to re-split the serialized strings:
             variant_rdg_serializations = []
-            for rdg in app.xpath('.//tei:rdg', namespaces={'tei': self.tei_ns})[1:]:
-                rdg_tokens = []
-                for el in rdg:
-                    if el.text is None:
-                        rdg_tokens.append(el.tag)
-                    else:
-                        rdg_tokens.append(el.text)
-                rdg_serialization = ' '.join(rdg_tokens)
-                variant_rdg_serializations.append(rdg_serialization)
-            #If all readings are equal in their fully-normalized form, then the variant is a vocalic one:
+            variant_rdg_token_counts = []
+            for rdg in rdgs:
+                rdg_tokens = self.get_rdg_tokens(rdg)
+                variant_rdg_serializations.append(' '.join(rdg_tokens))
+                variant_rdg_token_counts.append(len(rdg_tokens))
+            #If all readings are equal in their fully-normalized form, then the variant is a vocalic one;
+            #normalize the primary reading once instead of once per variant:
+            primary_rdg_formatted = normalizer.format_text(primary_rdg_serialization)
             is_vocalic = True
             for rdg_serialization in variant_rdg_serializations:
-                if normalizer.format_text(rdg_serialization) != normalizer.format_text(primary_rdg_serialization):
+                #Identical serializations need no normalization to compare equal:
+                if rdg_serialization == primary_rdg_serialization:
+                    continue
+                if normalizer.format_text(rdg_serialization) != primary_rdg_formatted:
                     is_vocalic = False
                     break
             if is_vocalic:
                 app.set('type', 'vocalic')
                 continue
             #Otherwise, if both readings stripped of plene letters are equal, then the variant is orthographic:
+            primary_rdg_plene_formatted = normalizer.format_stripped_text(primary_rdg_serialization)
             is_orthographic = True
             for rdg_serialization in variant_rdg_serializations:
-                if normalizer.format_text(normalizer.strip_plene(rdg_serialization)) != normalizer.format_text(normalizer.strip_plene(primary_rdg_serialization)):
+                #Identical serializations need no normalization to compare equal:
+                if rdg_serialization == primary_rdg_serialization:
+                    continue
+                if normalizer.format_stripped_text(rdg_serialization) != primary_rdg_plene_formatted:
                     is_orthographic = False
                     break
             if is_orthographic:
                 app.set('type', 'orthographic')
                 continue
             #Otherwise, if all readings in fully-normalized form are equal up to order, then the variant is a transposition:
+            primary_rdg_plene_set = set(primary_rdg_plene_formatted.split())
             is_transposition = True
             for rdg_serialization in variant_rdg_serializations:
-                if set(normalizer.format_text(normalizer.strip_plene(rdg_serialization)).split()) != set(normalizer.format_text(normalizer.strip_plene(primary_rdg_serialization)).split()):
+                #Identical serializations need no normalization to compare equal:
+                if rdg_serialization == primary_rdg_serialization:
+                    continue
+                if set(normalizer.format_stripped_text(rdg_serialization).split()) != primary_rdg_plene_set:
                     is_transposition = False
                     break
             if is_transposition:
                 app.set('type', 'transposition')
                 continue
             #Otherwise, check if the variant is an addition or an omission relative to the primary reading:
-            if len(primary_rdg_serialization.split()) == 0:
+            if len(primary_rdg_tokens) == 0:
                 is_addition = True
-                for rdg_serialization in variant_rdg_serializations:
-                    if len(rdg_serialization.split()) == 0:
+                for rdg_token_count in variant_rdg_token_counts:
+                    if rdg_token_count == 0:
                         is_addition = False
                         break
                 if is_addition:
@@ -93,8 +125,8 @@ class tei_labeler:
                     continue
             else:
                 is_omission = True
-                for rdg_serialization in variant_rdg_serializations:
-                    if len(rdg_serialization.split()) > 0:
+                for rdg_token_count in variant_rdg_token_counts:
+                    if rdg_token_count > 0:
                         is_omission = False
                         break
                 if is_omission:
@@ -104,120 +136,143 @@ class tei_labeler:
             app.set('type', 'substitution')
         return
     """
-    Recursively adds 'n' attributes to all <app/> elements in the given collation XML file using their lemma readings.
+    Adds 'n' attributes to all <app/> elements in the given collation XML file using their lemma readings.
+    The tree is traversed with a single iterative walk driven by lxml's iterwalk,
+    which avoids the per-element Python call overhead that recursion would incur.
     """
     def add_indices(self, xml):
-        #If the input is the tree itself, then recurse on its root:
-        if not et.iselement(xml):
-            self.add_indices(xml.getroot())
-            return
-        #Otherwise, proceed according to the element's tag:
-        raw_tag = xml.tag.replace('{%s}' % self.tei_ns, '')
-        #If it is a textual division, then add the index of its division unit to the Dictionary and reset the indices of any lower-level divisions and words:
-        if raw_tag == 'milestone':
-            if xml.get('unit') is not None:
-                div_type = xml.get('unit')
-                div_n = xml.get('n') if xml.get('n') is not None else ''
-                #If the division's index contains its number in addition to previous divisions' numbers, then just get the index for this division:
-                if div_type in ['incipit', 'explicit']:
-                    div_n = ''
-                elif self.div_abbreviations[div_type] in div_n:
-                    div_n = div_n[div_n.index(self.div_abbreviations[div_type]) + 1:]
-                #If the division is an incipit or explicit, then temporarily replace the 'chapter' entry with the appropriate division name in the hierarchy List:
-                if div_type in ['incipit', 'explicit']:
-                    if 'chapter' in self.div_hierarchy:
-                        self.div_hierarchy[self.div_hierarchy.index('chapter')] = div_type
-                    else:
-                        self.div_hierarchy.append(div_type)
-                #If the division is a chapter, then replace any 'incipit' or 'explicit' entries in the hierarchy List with 'chapter':
-                if div_type == 'chapter':
-                    if 'incipit' in self.div_hierarchy:
-                        self.div_hierarchy[self.div_hierarchy.index('incipit')] = div_type
-                    elif 'explicit' in self.div_hierarchy:
-                        self.div_hierarchy[self.div_hierarchy.index('explicit')] = div_type
-                #If this type of division has not been encountered yet, then add it to the hierarchy List:
-                if div_type not in self.div_hierarchy:
-                    self.div_hierarchy.append(div_type)
-                #Add this division's index to the Dictionary:
-                self.div_indices[div_type] = div_n
-                #Then reset the lower-level indices:
-                for other_div_type in self.div_hierarchy[self.div_hierarchy.index(div_type) + 1:]:
-                    self.div_indices[other_div_type] = '0'
-            return
-        #If it is a word, then add its index to the Dictionary:
-        if raw_tag == 'w':
-            if raw_tag not in self.div_indices:
-                self.div_hierarchy.append(raw_tag)
-                self.div_indices[raw_tag] = '0'
-            self.div_indices[raw_tag] = str(int(self.div_indices[raw_tag]) + 2)
-            return
-        #Otherwise, if it is an apparatus, then add an index to it:
-        if raw_tag == 'app':
-            #If no word has been encountered yet (i.e., if the first variant is at the very beginning of the text),
-            #then set it now:
-            if 'w' not in self.div_indices:
-                self.div_hierarchy.append('w')
-                self.div_indices['w'] = '0'
-            #Get the lemma reading:
-            lem = xml.xpath('.//tei:lem', namespaces={'tei': self.tei_ns})[0]
-            #Save the current indices:
-            app_start_indices = self.div_indices.copy()
-            #Index the children of the lemma reading:
-            for child in lem:
-                self.add_indices(child)
-            #Save the updated indices:
-            app_end_indices = self.div_indices.copy()
-            #If the start and end indices are the same, then either the apparatus covers a paratextual issue, 
-            #or the lemma reading is empty:
-            if app_start_indices == app_end_indices:
-                #If the apparatus contains at least one word, then the lemma reading is an omission;
-                #otherwise, use the starting indices as they are:
-                if len(xml.xpath('.//tei:w', namespaces={'tei': self.tei_ns})) > 0:
-                    app_start_indices['w'] = str(int(app_start_indices['w']) + 1)
-                app_n = ''
-                for div_type in self.div_hierarchy:
-                    #If we're in an incipit or explicit, then ignore the verse number:
-                    if ('incipit' in self.div_hierarchy or 'explicit' in self.div_hierarchy) and div_type == 'verse':
-                        continue
-                    app_n += self.div_abbreviations[div_type] + app_start_indices[div_type]
-                xml.set('n', app_n)
-            #Otherwise, the lemma contains at least one word: move the starting index to the index of this word:
-            else:
-                app_start_indices['w'] = str(int(app_start_indices['w']) + 2)
-                #If the start and end indices now match, then the lemma reading consists of one word:
+        #If the input is the tree itself, then walk from its root:
+        root = xml if et.iselement(xml) else xml.getroot()
+        #Maintain a stack of frames for open apparatuses, each consisting of the <app/> element
+        #and a snapshot of the indices at its start:
+        app_stack = []
+        #Bind the abbreviation Dictionary locally, as it is consulted for every apparatus index:
+        div_abbreviations = self.div_abbreviations
+        walker = et.iterwalk(root, events=('start', 'end'))
+        for event, elem in walker:
+            tag = elem.tag
+            if event == 'start':
+                #Within an apparatus, only the lemma reading contributes to the indices,
+                #so skip the subtrees of the apparatus's other children (i.e., its variant readings):
+                if app_stack and tag != self.lem_tag and elem.getparent() is app_stack[-1][0]:
+                    walker.skip_subtree()
+                    continue
+                #If it is a textual division, then add the index of its division unit to the Dictionary and reset the indices of any lower-level divisions and words:
+                if tag == self.milestone_tag:
+                    if elem.get('unit') is not None:
+                        div_type = elem.get('unit')
+                        div_n = elem.get('n') if elem.get('n') is not None else ''
+                        #If the division's index contains its number in addition to previous divisions' numbers, then just get the index for this division:
+                        if div_type in ['incipit', 'explicit']:
+                            div_n = ''
+                        elif div_abbreviations[div_type] in div_n:
+                            div_n = div_n[div_n.index(div_abbreviations[div_type]) + 1:]
+                        #If the division is an incipit or explicit, then temporarily replace the 'chapter' entry with the appropriate division name in the hierarchy List:
+                        if div_type in ['incipit', 'explicit']:
+                            if 'chapter' in self.div_order:
+                                position = self.div_order.pop('chapter')
+                                self.div_hierarchy[position] = div_type
+                                self.div_order[div_type] = position
+                            else:
+                                self.div_order[div_type] = len(self.div_hierarchy)
+                                self.div_hierarchy.append(div_type)
+                        #If the division is a chapter, then replace any 'incipit' or 'explicit' entries in the hierarchy List with 'chapter':
+                        if div_type == 'chapter':
+                            if 'incipit' in self.div_order:
+                                position = self.div_order.pop('incipit')
+                                self.div_hierarchy[position] = div_type
+                                self.div_order[div_type] = position
+                            elif 'explicit' in self.div_order:
+                                position = self.div_order.pop('explicit')
+                                self.div_hierarchy[position] = div_type
+                                self.div_order[div_type] = position
+                        #If this type of division has not been encountered yet, then add it to the hierarchy List:
+                        if div_type not in self.div_order:
+                            self.div_order[div_type] = len(self.div_hierarchy)
+                            self.div_hierarchy.append(div_type)
+                        #Add this division's index to the Dictionary:
+                        self.div_indices[div_type] = div_n
+                        #Then reset the lower-level indices:
+                        for other_div_type in self.div_hierarchy[self.div_order[div_type] + 1:]:
+                            self.div_indices[other_div_type] = 0
+                    continue
+                #If it is a word, then add its index to the Dictionary:
+                if tag == self.w_tag:
+                    #The word counter is kept as an int, so each word costs one increment
+                    #instead of a parse and format round-trip through str:
+                    if 'w' not in self.div_indices:
+                        self.div_order['w'] = len(self.div_hierarchy)
+                        self.div_hierarchy.append('w')
+                        self.div_indices['w'] = 0
+                    self.div_indices['w'] += 2
+                    continue
+                #Otherwise, if it is an apparatus, then open a frame for it; its index will be added when the walk exits it:
+                if tag == self.app_tag:
+                    #If no word has been encountered yet (i.e., if the first variant is at the very beginning of the text),
+                    #then set it now:
+                    if 'w' not in self.div_indices:
+                        self.div_order['w'] = len(self.div_hierarchy)
+                        self.div_hierarchy.append('w')
+                        self.div_indices['w'] = 0
+                    #Save the current indices:
+                    app_stack.append((elem, self.div_indices.copy()))
+                continue
+            #On exit from an apparatus, compare the updated indices against its starting snapshot and add an index to it:
+            if tag == self.app_tag:
+                app, app_start_indices = app_stack.pop()
+                #Save the updated indices:
+                app_end_indices = self.div_indices.copy()
+                #If the start and end indices are the same, then either the apparatus covers a paratextual issue, 
+                #or the lemma reading is empty:
                 if app_start_indices == app_end_indices:
-                    app_n = ''
+                    #If the apparatus contains at least one word, then the lemma reading is an omission;
+                    #otherwise, use the starting indices as they are:
+                    if next(app.iter(self.w_tag), None) is not None:
+                        app_start_indices['w'] += 1
+                    #Check once whether we're in an incipit or explicit, in which case verse numbers are ignored:
+                    in_paratext = 'incipit' in self.div_order or 'explicit' in self.div_order
+                    app_n_parts = []
                     for div_type in self.div_hierarchy:
-                        #If we're in an incipit or explicit, then ignore the verse number:
-                        if ('incipit' in self.div_hierarchy or 'explicit' in self.div_hierarchy) and div_type == 'verse':
+                        if in_paratext and div_type == 'verse':
                             continue
-                        app_n += self.div_abbreviations[div_type] + app_start_indices[div_type]
-                    xml.set('n', app_n)
-                #Otherwise, determine the first textual division level where the start index and the end index differ:
+                        app_n_parts.append(div_abbreviations[div_type])
+                        app_n_parts.append(str(app_start_indices[div_type]))
+                    app.set('n', ''.join(app_n_parts))
+                #Otherwise, the lemma contains at least one word: move the starting index to the index of this word:
                 else:
-                    difference_level = None
-                    for div_type in self.div_hierarchy:
-                        if app_start_indices[div_type] != app_end_indices[div_type]:
-                            difference_level = div_type
-                            break
-                    #Add a range marker after the start index and add only the part of the end index that isn't redundant:
-                    app_n = ''
-                    for div_type in self.div_hierarchy:
-                        #If we're in an incipit or explicit, then ignore the verse number:
-                        if ('incipit' in self.div_hierarchy or 'explicit' in self.div_hierarchy) and div_type == 'verse':
-                            continue
-                        app_n += self.div_abbreviations[div_type] + app_start_indices[div_type]
-                    app_n += '-'
-                    for div_type in self.div_hierarchy[self.div_hierarchy.index(difference_level):]:
-                        #If we're in an incipit or explicit, then ignore the verse number:
-                        if ('incipit' in self.div_hierarchy or 'explicit' in self.div_hierarchy) and div_type == 'verse':
-                            continue
-                        app_n += self.div_abbreviations[div_type] + app_end_indices[div_type]
-                    xml.set('n', app_n)
-            return
-        #For all other elements, process their children recursively:
-        for child in xml:
-            self.add_indices(child)
+                    app_start_indices['w'] += 2
+                    #Check once whether we're in an incipit or explicit, in which case verse numbers are ignored:
+                    in_paratext = 'incipit' in self.div_order or 'explicit' in self.div_order
+                    #If the start and end indices now match, then the lemma reading consists of one word:
+                    if app_start_indices == app_end_indices:
+                        app_n_parts = []
+                        for div_type in self.div_hierarchy:
+                            if in_paratext and div_type == 'verse':
+                                continue
+                            app_n_parts.append(div_abbreviations[div_type])
+                            app_n_parts.append(str(app_start_indices[div_type]))
+                        app.set('n', ''.join(app_n_parts))
+                    #Otherwise, determine the first textual division level where the start index and the end index differ:
+                    else:
+                        difference_level = None
+                        for div_type in self.div_hierarchy:
+                            if app_start_indices[div_type] != app_end_indices[div_type]:
+                                difference_level = div_type
+                                break
+                        #Add a range marker after the start index and add only the part of the end index that isn't redundant:
+                        app_n_parts = []
+                        for div_type in self.div_hierarchy:
+                            if in_paratext and div_type == 'verse':
+                                continue
+                            app_n_parts.append(div_abbreviations[div_type])
+                            app_n_parts.append(str(app_start_indices[div_type]))
+                        app_n_parts.append('-')
+                        for div_type in self.div_hierarchy[self.div_order[difference_level]:]:
+                            if in_paratext and div_type == 'verse':
+                                continue
+                            app_n_parts.append(div_abbreviations[div_type])
+                            app_n_parts.append(str(app_end_indices[div_type]))
+                        app.set('n', ''.join(app_n_parts))
         return
     """
     Labels to all <app/> elements in the given XML tree, adding 'type' and 'n' attributes to each one.
@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+
+import argparse
+import re
+from lxml import etree as et
+
+"""
+Class representing a polyglossia language with a name and a Dictionary of options.
+"""
+class polyglossia_language:
+    def __init__(self, name, options=None):
+        self.name = name
+        self.options = options if options is not None else {}
+
+"""
+Dictionary of shared polyglossia_language instances, keyed by name and options.
+"""
+polyglossia_language_cache = {}
+
+"""
+Returns a shared polyglossia_language instance for the given name and options;
+several ISO codes map to the same language, so equivalent entries share one instance.
+"""
+def shared_polyglossia_language(name, options=None):
+    key = (name, tuple(sorted(options.items())) if options is not None else ())
+    if key not in polyglossia_language_cache:
+        polyglossia_language_cache[key] = polyglossia_language(name, options)
+    return polyglossia_language_cache[key]
+
+"""
+Class for converting a transcription (including collation data) in TEI XML format to LaTeX format.
+"""
+class tei_latex_converter:
+    """
+    XML namespaces
+    """
+    xml_ns = 'http://www.w3.org/XML/1998/namespace'
+    tei_ns = 'http://www.tei-c.org/ns/1.0'
+    """
+    Dictionary mapping ISO 639-3 language codes to polyglossia languages
+    """
+    iso_to_polyglossia = {
+        'afr': shared_polyglossia_language('afrikaans'),
+        'sqi': shared_polyglossia_language('albanian'),
+        'amh': shared_polyglossia_language('amharic'),
+        'ara': shared_polyglossia_language('arabic'),
+        'arz': shared_polyglossia_language('arabic'),
+        'apd': shared_polyglossia_language('arabic'),
+        'afb': shared_polyglossia_language('arabic'),
+        'ayl': shared_polyglossia_language('arabic', {'locale': 'libya'}),
+        'arq': shared_polyglossia_language('arabic', {'locale': 'algeria'}),
+        'aeb': shared_polyglossia_language('arabic', {'locale': 'tunisia'}),
+        'ary': shared_polyglossia_language('arabic', {'locale': 'morocco'}),
+        'hye': shared_polyglossia_language('armenian'),
+        'hyw': shared_polyglossia_language('armenian', {'variant': 'western'}),
+        'ast': shared_polyglossia_language('asturian'),
+        'eus': shared_polyglossia_language('basque'),
+        'bel': shared_polyglossia_language('belarusian'),
+        'ben': shared_polyglossia_language('bengali'),
+        'bos': shared_polyglossia_language('bosnian'),
+        'bre': shared_polyglossia_language('breton'),
+        'bul': shared_polyglossia_language('bulgarian'),
+        'cat': shared_polyglossia_language('catalan'),
+        'cop': shared_polyglossia_language('coptic'),
+        'hrv': shared_polyglossia_language('croatian'),
+        'ces': shared_polyglossia_language('czech'),
+        'dan': shared_polyglossia_language('danish'),
+        'div': shared_polyglossia_language('divehi'),
+        'nld': shared_polyglossia_language('dutch'),
+        'eng': shared_polyglossia_language('english'),
+        'epo': shared_polyglossia_language('esperanto'),
+        'est': shared_polyglossia_language('estonian'),
+        'fin': shared_polyglossia_language('finnish'),
+        'fra': shared_polyglossia_language('french'),
+        'fur': shared_polyglossia_language('friulian'),
+        'gle': shared_polyglossia_language('gaelic'),
+        'gla': shared_polyglossia_language('gaelic', {'variant': 'scottish'}),
+        'glg': shared_polyglossia_language('galician'),
+        'kat': shared_polyglossia_language('georgian'),
+        'deu': shared_polyglossia_language('german'),
+        'gsw': shared_polyglossia_language('german', {'variant': 'swiss'}),
+        'ell': shared_polyglossia_language('greek'),
+        'grc': shared_polyglossia_language('greek', {'variant': 'ancient'}),
+        'heb': shared_polyglossia_language('hebrew'),
+        'hin': shared_polyglossia_language('hindi'),
+        'hun': shared_polyglossia_language('hungarian'),
+        'isl': shared_polyglossia_language('icelandic'),
+        'ina': shared_polyglossia_language('interlingua'),
+        'ita': shared_polyglossia_language('italian'),
+        'jpn': shared_polyglossia_language('japanese'),
+        'kan': shared_polyglossia_language('kannada'),
+        'khm': shared_polyglossia_language('khmer'),
+        'kor': shared_polyglossia_language('korean'),
+        'kur': shared_polyglossia_language('kurdish'),
+        'kmi': shared_polyglossia_language('kurdish'),
+        'ckb': shared_polyglossia_language('kurdish', {'variant': 'sorani'}),
+        'lao': shared_polyglossia_language('lao'),
+        'lat': shared_polyglossia_language('latin'),
+        'lav': shared_polyglossia_language('latvian'),
+        'lit': shared_polyglossia_language('lithuanian'),
+        'mkd': shared_polyglossia_language('macedonian'),
+        'msa': shared_polyglossia_language('malay'),
+        'zsm': shared_polyglossia_language('malay'),
+        'ind': shared_polyglossia_language('malay', {'variant': 'indonesian'}),
+        'mal': shared_polyglossia_language('malayalam'),
+        'mar': shared_polyglossia_language('marathi'),
+        'mon': shared_polyglossia_language('mongolian'),
+        'nqo': shared_polyglossia_language('nko'),
+        'nor': shared_polyglossia_language('norwegian'),
+        'nob': shared_polyglossia_language('norwegian'),
+        'nno': shared_polyglossia_language('norwegian', {'variant': 'nynorsk'}),
+        'oci': shared_polyglossia_language('occitan'),
+        'fas': shared_polyglossia_language('persian'),
+        'pms': shared_polyglossia_language('piedmontese'),
+        'pol': shared_polyglossia_language('polish'),
+        'por': shared_polyglossia_language('portuguese'),
+        'ron': shared_polyglossia_language('romanian'),
+        'roh': shared_polyglossia_language('romansh'),
+        'rus': shared_polyglossia_language('russian'),
+        'sme': shared_polyglossia_language('sami'),
+        'san': shared_polyglossia_language('sanskrit'),
+        'srp': shared_polyglossia_language('serbian'),
+        'slk': shared_polyglossia_language('slovak'),
+        'slv': shared_polyglossia_language('slovenian'),
+        'dsb': shared_polyglossia_language('sorbian'),
+        'hsb': shared_polyglossia_language('sorbian', {'variant': 'upper'}),
+        'spa': shared_polyglossia_language('spanish'),
+        'swe': shared_polyglossia_language('swedish'),
+        'syr': shared_polyglossia_language('syriac'),
+        'tam': shared_polyglossia_language('tamil'),
+        'tel': shared_polyglossia_language('telugu'),
+        'tha': shared_polyglossia_language('thai'),
+        'bod': shared_polyglossia_language('tibetan'),
+        'tur': shared_polyglossia_language('turkish'),
+        'tuk': shared_polyglossia_language('turkmen'),
+        'ukr': shared_polyglossia_language('ukrainian'),
+        'urd': shared_polyglossia_language('urdu'),
+        'vie': shared_polyglossia_language('vietnamese'),
+        'cym': shared_polyglossia_language('welsh')
+    }
+    """
+    Precompiled XPath expressions, compiled once at class scope so that repeated evaluations reuse them
+    """
+    body_xpath = et.XPath('//tei:body', namespaces={'tei': tei_ns})
+    incipit_divgen_xpath = et.XPath(".//tei:divGen[@type='incipit']", namespaces={'tei': tei_ns})
+    chapter_divgen_xpath = et.XPath(".//tei:divGen[@type='chapter']", namespaces={'tei': tei_ns})
+    """
+    Clark-notation tag strings, precomputed once; lxml interns tags, so comparing against these
+    replaces the string replace that stripping the namespace would cost on every node
+    """
+    tei_tag = '{%s}TEI' % tei_ns
+    text_tag = '{%s}text' % tei_ns
+    body_tag = '{%s}body' % tei_ns
+    divgen_tag = '{%s}divGen' % tei_ns
+    app_tag = '{%s}app' % tei_ns
+    lem_tag = '{%s}lem' % tei_ns
+    rdg_tag = '{%s}rdg' % tei_ns
+    lb_tag = '{%s}lb' % tei_ns
+    pb_tag = '{%s}pb' % tei_ns
+    p_tag = '{%s}p' % tei_ns
+    pc_tag = '{%s}pc' % tei_ns
+    space_tag = '{%s}space' % tei_ns
+    w_tag = '{%s}w' % tei_ns
+    """
+    Clark-notation attribute name for xml:lang, precomputed once
+    """
+    xml_lang_attr = '{%s}lang' % xml_ns
+    """
+    Frozensets of tags used in the separator membership tests below,
+    built once instead of allocating a fresh list on every child
+    """
+    inline_tags = frozenset([space_tag, app_tag, w_tag])
+    word_end_tags = frozenset([app_tag, w_tag, pc_tag])
+    par_break_tags = frozenset([p_tag, lb_tag])
+    word_tags = frozenset([w_tag, pc_tag])
+    """
+    Dictionary mapping apparatus types to their opening and closing LaTeX macros;
+    additions have no closing macro
+    """
+    app_macros = {
+        'addition': ('\\Add{', ''),
+        'omission': ('\\OmitBegin{', '\\OmitEnd{}'),
+        'transposition': ('\\TransBegin{', '\\TransEnd{}'),
+        'substitution': ('\\SubBegin{', '\\SubEnd{}')
+    }
+
+    def __init__(self, **kwargs):
+        #Populate a String referring to the relative path of the subfiles source (if there is one):
+        self.subfiles_path = kwargs['subfiles_path'] if 'subfiles_path' in kwargs else None
+        #Populate a List of witness substitution patterns:
+        self.wit_sub_patterns = kwargs['wit_sub_patterns'] if 'wit_sub_patterns' in kwargs else []
+        #Compile the substitution patterns into a Dictionary and a single alternation regex
+        #(with longer patterns first, so they take precedence over their prefixes),
+        #so each witness string is rewritten in one pass rather than once per pattern:
+        self.wit_sub_map = {}
+        for old, new in self.wit_sub_patterns:
+            self.wit_sub_map[old] = new
+        if len(self.wit_sub_map) > 0:
+            patterns = sorted(self.wit_sub_map, key=len, reverse=True)
+            self.wit_sub_re = re.compile('|'.join(re.escape(pattern) for pattern in patterns))
+        else:
+            self.wit_sub_re = None
+        #Populate a Set of ignored apparatus types:
+        self.ignored_app_types = kwargs['ignored_app_types'] if 'ignored_app_types' in kwargs else set()
+        #Initialize the book title, which will be populated from the transcription:
+        self.book_title = ''
+        return
+    """
+    Returns the serialized title of the book, taken from the words between the incipit and first chapter <divGen/> elements.
+    """
+    def get_book_title(self, xml):
+        #Accumulate the title's words in a List and join them once at the end,
+        #rather than concatenating onto an ever-longer string:
+        words = []
+        #Get the <divGen/> elements bounding the title:
+        body = self.body_xpath(xml)[0]
+        incipit_divgen = self.incipit_divgen_xpath(body)[0]
+        chapter_divgen = self.chapter_divgen_xpath(body)[0]
+        #Serialize the words between them, including the lemma words of any apparatus;
+        #following sibling links is a constant-time step per child, where indexing into the body
+        #would walk its child list from the start on every access:
+        child = incipit_divgen
+        while child is not chapter_divgen:
+            if child.tag == self.w_tag:
+                words.append(child.text)
+            elif child.tag == self.app_tag:
+                #The lemma is a direct child of the apparatus, and its words are direct children in turn,
+                #so child iteration with a tag filter reaches them without a descendant XPath walk:
+                lem = next(child.iterchildren(self.lem_tag))
+                for w in lem.iterchildren(self.w_tag):
+                    words.append(w.text)
+            child = child.getnext()
+        return ' '.join(words)
+    """
+    Recursively converts a transcription (including collation data) in TEI XML format to LaTeX format.
+    """
+    def to_latex(self, xml):
+        #Accumulate the LaTeX fragments in a List threaded through the recursion and join them once,
+        #rather than concatenating and copying ever-longer strings at every level:
+        parts = []
+        #If the input is an XML tree and not an element, then get the book title and recurse on its root element:
+        if not et.iselement(xml):
+            self.book_title = self.get_book_title(xml)
+            self.to_latex_parts(xml.getroot(), parts)
+        else:
+            self.to_latex_parts(xml, parts)
+        return ''.join(parts)
+    """
+    Recursively converts an element of a TEI XML transcription to LaTeX format,
+    appending the fragments to the given List.
+    """
+    def to_latex_parts(self, xml, parts):
+        #Proceed according to the element's tag:
+        tag = xml.tag
+        if tag == self.tei_tag:
+            #Open the document with the appropriate document class:
+            if self.subfiles_path is not None:
+                parts.append('\\documentclass[%s]{subfiles}\n' % self.subfiles_path)
+            else:
+                parts.append('\\documentclass{memoir}\n')
+            #Process the <text/> element under this element:
+            for child in xml:
+                self.to_latex_parts(child, parts)
+            return
+        if tag == self.text_tag:
+            #Select the language via polyglossia based on the xml:lang attribute:
+            language = shared_polyglossia_language('english')
+            if xml.get(self.xml_lang_attr) is not None:
+                iso_code = xml.get(self.xml_lang_attr)
+                if iso_code in self.iso_to_polyglossia:
+                    language = self.iso_to_polyglossia[iso_code]
+            parts.append('\\begin{document}\n')
+            parts.append('\\selectlanguage')
+            if len(language.options) > 0:
+                parts.append('[')
+                opt_strs = []
+                for opt in language.options:
+                    opt_strs.append(opt + '=' + language.options[opt])
+                parts.append(', '.join(opt_strs))
+                parts.append(']')
+            parts.append('{' + language.name + '}\n')
+            #Process the <front/>, <body/>, and <back/> elements under this element:
+            for child in xml:
+                self.to_latex_parts(child, parts)
+                parts.append('\n')
+            parts.append('\n\\end{document}')
+            return
+        if tag == self.body_tag:
+            #Process the children of the body, adding the appropriate separators between them;
+            #words are emitted inline here, as recursing per word would cost a Python call
+            #for the most common element in the document:
+            prev_tag = self.body_tag
+            for child in xml:
+                current_tag = child.tag
+                if current_tag in self.inline_tags:
+                    if prev_tag in self.word_end_tags:
+                        parts.append(' ')
+                    if prev_tag in self.par_break_tags:
+                        parts.append('\\par\n')
+                    elif prev_tag == self.pb_tag:
+                        parts.append('\\par\n\\pagebreak\n')
+                elif current_tag == self.divgen_tag:
+                    if child.get('type') == 'chapter':
+                        if prev_tag in self.word_end_tags:
+                            parts.append('\\PreChapterSpace{}')
+                    elif child.get('type') == 'verse':
+                        if prev_tag in self.word_end_tags:
+                            parts.append('\\PreVerseSpace{}')
+                if current_tag == self.w_tag or current_tag == self.pc_tag:
+                    parts.append(child.text)
+                else:
+                    self.to_latex_parts(child, parts)
+                prev_tag = current_tag
+            #Close out the final page and the multicols environment (opened at the first chapter):
+            parts.append('\\par\n\\pagebreak\n\\end{multicols}')
+            return
+        if tag == self.divgen_tag and xml.get('type') is not None and xml.get('n') is not None:
+            #Proceed based on the type of the textual division:
+            if xml.get('type') == 'book':
+                parts.append('\\Book{' + self.book_title + '}')
+            elif xml.get('type') == 'incipit':
+                parts.append('\\Incipit{}')
+            elif xml.get('type') == 'explicit':
+                parts.append('\\Explicit{}')
+            elif xml.get('type') == 'chapter':
+                #Parse out the chapter number after the chapter marker in a single scan:
+                head, found, chapter_num = xml.get('n').rpartition('K')
+                chapter_n = chapter_num if found else xml.get('n')
+                #If this is the first chapter, then open the multicols environment first:
+                if found and chapter_n == '1':
+                    parts.append('\\vspace{\\afterchapskip}\n\\RTLmulticolcolumns\n\\begin{multicols}{\\ncols}\n')
+                parts.append('\\Chapter{' + chapter_n + '}')
+            elif xml.get('type') == 'verse':
+                #Parse out the verse number after the verse marker in a single scan:
+                head, found, verse_num = xml.get('n').rpartition('V')
+                verse_n = verse_num if found else xml.get('n')
+                parts.append('\\Verse{' + verse_n + '}')
+            return
+        if tag == self.app_tag:
+            #Get the type of this apparatus, defaulting to substitution:
+            app_type = xml.get('type') if xml.get('type') is not None else 'substitution'
+            #If this is not an ignored type, then open the appropriate macro and typeset the variant readings:
+            if app_type not in self.ignored_app_types:
+                #Look up the opening and closing macros for this type of apparatus, defaulting to substitution:
+                open_macro, close_macro = self.app_macros.get(app_type, self.app_macros['substitution'])
+                parts.append(open_macro)
+                rdg_index = 0
+                #The readings are direct children of the apparatus:
+                for rdg in xml.iterchildren(self.rdg_tag):
+                    if rdg_index == 1:
+                        parts.append('\\PrimaryReadingSep{}')
+                    elif rdg_index > 1:
+                        parts.append('\\SecondaryReadingSep{}')
+                    self.to_latex_parts(rdg, parts)
+                    rdg_index += 1
+                parts.append('}')
+            #Typeset the lemma reading (a direct child of the apparatus):
+            lem = next(xml.iterchildren(self.lem_tag))
+            self.to_latex_parts(lem, parts)
+            #Then close the macro if this is not an ignored type:
+            if app_type not in self.ignored_app_types:
+                if close_macro != '':
+                    parts.append(close_macro)
+            return
+        if tag == self.lem_tag:
+            #If the lemma reading is empty, then nothing needs to be typeset:
+            if len(xml) == 0:
+                return
+            #Otherwise, process its children, adding the appropriate separators between them:
+            prev_tag = self.lem_tag
+            for lem_child in xml:
+                current_tag = lem_child.tag
+                if current_tag == self.w_tag:
+                    if prev_tag in self.word_tags:
+                        parts.append(' ')
+                    elif prev_tag in self.par_break_tags:
+                        parts.append('\\par\n')
+                if current_tag == self.w_tag or current_tag == self.pc_tag:
+                    parts.append(lem_child.text)
+                else:
+                    self.to_latex_parts(lem_child, parts)
+                prev_tag = current_tag
+            return
+        if tag == self.rdg_tag:
+            parts.append('\\Reading{')
+            #If the reading is empty, then mark it as an omission:
+            if len(xml) == 0:
+                parts.append('\\Omit{}')
+            else:
+                #Otherwise, process its children, adding the appropriate separators between them:
+                prev_tag = self.rdg_tag
+                for rdg_child in xml:
+                    current_tag = rdg_child.tag
+                    if current_tag == self.w_tag:
+                        if prev_tag in self.word_tags:
+                            parts.append(' ')
+                        elif prev_tag in self.par_break_tags:
+                            parts.append('\\par\n')
+                    if current_tag == self.w_tag or current_tag == self.pc_tag:
+                        parts.append(rdg_child.text)
+                    else:
+                        self.to_latex_parts(rdg_child, parts)
+                    prev_tag = current_tag
+            parts.append('}')
+            #Typeset the witness list of this reading:
+            wit = xml.get('wit')
+            if self.wit_sub_re is not None:
+                wit = self.wit_sub_re.sub(lambda match: self.wit_sub_map[match.group(0)], wit)
+            witnesses = wit.split()
+            for witness in witnesses:
+                parts.append('\\Witness{%s}' % witness)
+            return
+        if tag == self.lb_tag:
+            if xml.get('type') is not None:
+                lb_type = xml.get('type')
+                if lb_type == 'open':
+                    parts.append('\\OpenSection{}')
+            return
+        if tag == self.space_tag:
+            if xml.get('type') is not None:
+                space_type = xml.get('type')
+                if space_type == 'closed':
+                    parts.append('\\ClosedSection{}')
+            return
+        if tag in self.word_tags:
+            parts.append(xml.text)
+            return
+        return
@@ -14,61 +14,150 @@ class tei_normalizer:
     xml_ns = 'http://www.w3.org/XML/1998/namespace'
     tei_ns = 'http://www.tei-c.org/ns/1.0'
     """
-    Dictionary of regular expressions, keyed by accentuation type:
+    Dictionary of regular expression character classes, keyed by accentuation type:
     """
-    accentuatation_res = {
-        'cantillation': re.compile('[\u0591-\u05AF\u05BD\u05BF\u200C-\u200D]'), #meteg (\u05BD) is described as a point in its Unicode name, but it's functionally an accent #TODO: should zero-width joiners and non-joiners (\u200C-\u200D) belong to the pointing accentuation set?
-        'pointing': re.compile('[\u05B0-\u05BC\u05C1-\u05C2\u05C7]'),
-        'extraordinaire': re.compile('[\u05C4-\u05C5]')
+    accentuatation_classes = {
+        'cantillation': '\u0591-\u05AF\u05BD\u05BF\u200C-\u200D', #meteg (\u05BD) is described as a point in its Unicode name, but it's functionally an accent #TODO: should zero-width joiners and non-joiners (\u200C-\u200D) belong to the pointing accentuation set?
+        'pointing': '\u05B0-\u05BC\u05C1-\u05C2\u05C7',
+        'extraordinaire': '\u05C4-\u05C5'
     }
     """
+    Dictionary of regular expressions, keyed by accentuation type:
+    """
+    accentuatation_res = {accentuation_type: re.compile('[' + accentuation_class + ']') for accentuation_type, accentuation_class in accentuatation_classes.items()}
+    """
+    Clark-notation tag strings, precomputed once so tag tests don't rebuild and strip
+    the namespace prefix on every node:
+    """
+    div_tag = '{%s}div' % tei_ns
+    ab_tag = '{%s}ab' % tei_ns
+    milestone_tag = '{%s}milestone' % tei_ns
+    app_tag = '{%s}app' % tei_ns
+    pc_tag = '{%s}pc' % tei_ns
+    """
+    Regular expression matching any non-ASCII character, used to detect inputs that normalization cannot change:
+    """
+    non_ascii_re = re.compile('[^\x00-\x7F]')
+    """
     Whitespace characters to facilitate pretty-printing, keyed by element tag:
     """
     pretty_print_whitespace = {
-        'pb': '',
-        'cb': '',
-        'lb': '',
-        'p': '',
-        'space': '',
-        'app': '',
-        'lem': '',
-        'rdg': '',
-        'w': '',
-        'pc': ''
+        '{%s}pb' % tei_ns: '',
+        '{%s}cb' % tei_ns: '',
+        '{%s}lb' % tei_ns: '',
+        '{%s}p' % tei_ns: '',
+        '{%s}space' % tei_ns: '',
+        '{%s}app' % tei_ns: '',
+        '{%s}lem' % tei_ns: '',
+        '{%s}rdg' % tei_ns: '',
+        '{%s}w' % tei_ns: '',
+        '{%s}pc' % tei_ns: ''
     }
     def __init__(self, **params):
         self.ignored_accent_set = params['a'] if 'a' in params else set()
         self.ignored_punc_set = params['p'] if 'p' in params else set()
         self.preferred_rdg_type = params['r'] if 'r' in params else None
         self.ignored_tag_set = params['t'] if 't' in params else set()
+        #Precompute the Clark-notation forms of the ignored tags for direct comparison against element tags:
+        self.ignored_clark_tag_set = set('{%s}%s' % (self.tei_ns, ignored_tag) for ignored_tag in self.ignored_tag_set)
+        #Build a translation table that deletes every character in the ignored accentuation
+        #classes, so format_text strips them all in a single C-level pass over the string:
+        if len(self.ignored_accent_set) > 0:
+            self.ignored_accents_table = {}
+            for accentuation_type in sorted(self.ignored_accent_set):
+                accentuation_class = self.accentuatation_classes[accentuation_type]
+                i = 0
+                while i < len(accentuation_class):
+                    #Expand 'a-b' range notation; other characters stand for themselves:
+                    if i + 2 < len(accentuation_class) and accentuation_class[i + 1] == '-':
+                        for cp in range(ord(accentuation_class[i]), ord(accentuation_class[i + 2]) + 1):
+                            self.ignored_accents_table[cp] = None
+                        i += 3
+                    else:
+                        self.ignored_accents_table[ord(accentuation_class[i])] = None
+                        i += 1
+        else:
+            self.ignored_accents_table = None
+        #Caches of previously computed normalizations, keyed by input string;
+        #the same readings are normalized repeatedly during labeling and collation:
+        self.format_text_cache = {}
+        self.strip_plene_cache = {}
+        self.format_stripped_text_cache = {}
     """
     Given a String, conditionally strips different types of accentuation from it according to the parameters of this normalizer.
+    Results are cached per input string.
     """
     def format_text(self, s):
-        s = ud.normalize('NFKD', s) #decompose any precomposed Unicode characters
-        for accentuation_type in self.ignored_accent_set:
-            regex = self.accentuatation_res[accentuation_type]
-            s = re.sub(regex, '', s)
+        if s in self.format_text_cache:
+            return self.format_text_cache[s]
+        result = self.format_text_uncached(s)
+        self.format_text_cache[s] = result
+        return result
+    """
+    Computes the formatted form of the given String without consulting the cache.
+    """
+    def format_text_uncached(self, s):
+        #ASCII strings (serialized tags, punctuation, empty readings) are fixed points of
+        #Unicode normalization, and the accent ranges are all Hebrew, so return them as-is:
+        if self.non_ascii_re.search(s) is None:
+            return s
+        return self.format_text_nfkd(ud.normalize('NFKD', s))
+    """
+    Formats a String that has already been decomposed to NFKD, skipping the opening decomposition.
+    """
+    def format_text_nfkd(self, s):
+        if self.ignored_accents_table is not None:
+            s = s.translate(self.ignored_accents_table)
         s = ud.normalize('NFC', s) #re-compose the decomposed Unicode characters
         return s
     """
+    Given a String, returns its plene-stripped form passed through format_text.
+    The two steps are fused so the intermediate string is not re-composed to NFC
+    and decomposed back to NFKD between them. Results are cached per input string.
+    """
+    def format_stripped_text(self, s):
+        if s in self.format_stripped_text_cache:
+            return self.format_stripped_text_cache[s]
+        result = self.format_text_nfkd(self.strip_plene_nfkd(ud.normalize('NFKD', s)))
+        self.format_stripped_text_cache[s] = result
+        return result
+    """
     Given a String (assumed to have pointing), returns it with any plene / male letters replaced with their defective vocalizations.
+    Results are cached per input string.
     """
     def strip_plene(self, s):
-        #First, decompose any precomposed Unicode characters:
-        s = ud.normalize('NFKD', s) 
-        #Then loop through the characters, grouping points with the appropriate characters:
-        letters_re = re.compile('[\u05D0-\u05EA]')
-        vowels_re = self.accentuatation_res['pointing']
+        if s in self.strip_plene_cache:
+            return self.strip_plene_cache[s]
+        result = self.strip_plene_uncached(s)
+        self.strip_plene_cache[s] = result
+        return result
+    """
+    Computes the plene-stripped form of the given String without consulting the cache.
+    """
+    def strip_plene_uncached(self, s):
+        #Decompose any precomposed Unicode characters, strip the plene letters,
+        #and re-compose the result:
+        return ud.normalize('NFC', self.strip_plene_nfkd(ud.normalize('NFKD', s)))
+    """
+    Strips plene / male letters from a String that has already been decomposed to NFKD,
+    returning the still-decomposed result.
+    """
+    def strip_plene_nfkd(self, s):
+        #Loop through the characters, grouping points with the appropriate characters;
+        #letters and pointing are recognized with integer codepoint range tests,
+        #so each character is classified once with no regex matching:
         letters_with_pointing = []
         letter_with_pointing = ''
-        new_letter = False
         for c in s:
+            cp = ord(c)
+            is_space = cp == 0x20
+            is_letter = 0x05D0 <= cp <= 0x05EA
+            is_vowel = 0x05B0 <= cp <= 0x05BC or 0x05C1 <= cp <= 0x05C2 or cp == 0x05C7
             #Skip any characters that are not relevant to this process:
-            if c != ' ' and letters_re.match(c) is None and vowels_re.match(c) is None:
+            if not is_space and not is_letter and not is_vowel:
                 continue
             #If the current character is a space or a letter, then add all characters in the queue as a new letter with pointing:
-            if c == ' ' or letters_re.match(c):
+            if is_space or is_letter:
                 letters_with_pointing.append(letter_with_pointing)
                 letter_with_pointing = ''
             #Add the current character to the queue:
@@ -119,28 +208,32 @@ class tei_normalizer:
             #Then update the previous letter and move on:
             prev_letter_with_pointing = current_letter_with_pointing
         #Then join the resulting characters into a single String:
-        s = ''.join(letters_with_pointing)
-        #Then re-compose the decomposed Unicode characters:
-        s = ud.normalize('NFC', s)
-        return s
+        return ''.join(letters_with_pointing)
+    """
+    Appends the given formatted tail to the last child of the given output element,
+    or to the element's text if it has no children.
+    """
+    def merge_tail(self, out_xml, tail):
+        if len(out_xml) > 0:
+            last = out_xml[-1]
+            last.tail = last.tail + tail if last.tail is not None else tail
+        else:
+            out_xml.text = out_xml.text + tail if out_xml.text is not None else tail
+        return
     """
     Given an XML element, adds the appropriate whitespace character to its tail to facilitate pretty-printing.
     """
     def add_pretty_print_tail(self, xml):
-        raw_tag = xml.tag.replace('{%s}' % self.tei_ns, '')
-        if raw_tag in self.pretty_print_whitespace:
-            whitespace = self.pretty_print_whitespace[raw_tag]
-            xml.tail = whitespace if xml.text is None else xml.tail
+        whitespace = self.pretty_print_whitespace.get(xml.tag)
+        if whitespace is not None and xml.text is None:
+            xml.tail = whitespace
         return
     """
     Given a TEI <app/> XML element, returns a List of the children of the <rdg/> element whose type matches the preferred reading type of this normalizer.
     """
     def get_preferred_rdg_elements(self, xml):
-        rdg_children = []
         rdg = xml.xpath('tei:rdg[@type=\'%s\']' % self.preferred_rdg_type, namespaces={'tei': self.tei_ns})[0]
-        for child in rdg.getchildren():
-            rdg_children.append(child)
-        return rdg_children
+        return list(rdg)
     """
     Recursively normalizes an input XML element and its children according to the parameters of this normalizer.
     """
@@ -153,8 +246,8 @@ class tei_normalizer:
         #Get the element tag:
         tag = xml.tag
         #Convert hierarchical div and ab elements to flat milestone elements:
-        if tag.replace('{%s}' % self.tei_ns, '') in ['div', 'ab']:
-            tag = '{%s}milestone' % self.tei_ns
+        if tag == self.div_tag or tag == self.ab_tag:
+            tag = self.milestone_tag
         #If this element has no parent, then add the namespace map to the normalized element:
         if xml.getparent() is None:
             out_xml = et.Element(tag, nsmap={None: self.tei_ns, 'xml': self.xml_ns})
@@ -162,51 +255,41 @@ class tei_normalizer:
         else:
             out_xml = et.Element(tag)
         #If the original element was a verse division, then add an attribute indicating this:
-        if xml.tag.replace('{%s}' % self.tei_ns, '') == 'ab':
+        if xml.tag == self.ab_tag:
             out_xml.set('unit', 'verse')
         #Copy all attributes to the output element:
-        for attr in xml.attrib:
-            #If the element was a textual division, then replace their "type" attribute with a "unit" attribute;
-            if xml.tag.replace('{%s}' % self.tei_ns, '') in ['div'] and attr == 'type':
-                out_xml.set('unit', xml.get(attr))
-            #Otherwise, copy the attribute as-is:
-            else:
-                out_xml.set(attr, xml.get(attr))
+        if xml.tag == self.div_tag:
+            #If the element was a textual division, then replace its "type" attribute with a "unit" attribute,
+            #copying the other attributes as they are:
+            for attr in xml.attrib:
+                if attr == 'type':
+                    out_xml.set('unit', xml.get(attr))
+                else:
+                    out_xml.set(attr, xml.get(attr))
+        #Otherwise, copy the attributes in one bulk operation:
+        elif len(xml.attrib) > 0:
+            out_xml.attrib.update(xml.attrib)
         #Conditionally format the text:
         if xml.text is not None:
             out_xml.text = self.format_text(xml.text)
         #Then recursively normalize all child elements:
-        for child in xml.getchildren():
+        for child in xml:
             #Skip elements whose tags are in the ignored tag set:
-            if child.tag.replace('{%s}' % self.tei_ns, '') in self.ignored_tag_set:
+            if child.tag in self.ignored_clark_tag_set:
                 #But conditionally format their tails, if they has one: 
                 if child.tail is not None:
-                    tail = self.format_text(child.tail)
-                    #Append this tail to the last child of the output element,
-                    #or to the text of the output element if it has no children:
-                    if len(out_xml.getchildren()) > 0:
-                        last = out_xml.getchildren()[-1]
-                        last.tail = last.tail + tail if last.tail is not None else tail
-                    else:
-                        out_xml.text = out_xml.text + tail if out_xml.text is not None else tail
+                    self.merge_tail(out_xml, self.format_text(child.tail))
                 continue
             #Skip punctuation elements whose text values are in the ignored punctuation set:
-            if child.tag.replace('{%s}' % self.tei_ns, '') == 'pc':
+            if child.tag == self.pc_tag:
                 if child.text is not None and child.text in self.ignored_punc_set:
                     #But conditionally format their tails, if they has one: 
                     if child.tail is not None:
-                        tail = self.format_text(child.tail)
-                        #Append this tail to the last child of the output element,
-                        #or to the text of the output element if it has no children:
-                        if len(out_xml.getchildren()) > 0:
-                            last = out_xml.getchildren()[-1]
-                            last.tail = last.tail + tail if last.tail is not None else tail
-                        else:
-                            out_xml.text = out_xml.text + tail if out_xml.text is not None else tail
+                        self.merge_tail(out_xml, self.format_text(child.tail))
                     continue
             out_child = self.normalize(child)
             #If the child is an app instance, then process it conditionally:
-            if out_child.tag.replace('{%s}' % self.tei_ns, '') == 'app':
+            if out_child.tag == self.app_tag:
                 if self.preferred_rdg_type is not None:
                     #Just get the ketiv reading's child elements, and add them instead:
                     preferred_rdg_elements = self.get_preferred_rdg_elements(out_child)
@@ -215,8 +298,8 @@ class tei_normalizer:
                 else:
                     out_xml.append(out_child)
             #Otherwise, if the child has been converted to a milestone instance, then make its children its siblings:
-            elif out_child.tag.replace('{%s}' % self.tei_ns, '') == 'milestone':
-                out_grandchildren = out_child.getchildren()
+            elif out_child.tag == self.milestone_tag:
+                out_grandchildren = list(out_child)
                 for out_grandchild in out_grandchildren:
                     out_child.remove(out_grandchild)
                 out_child.text = None #Remove whitespace to ensure that the element's opening and closing tags are merged
@@ -229,6 +312,7 @@ class tei_normalizer:
             #Conditionally format the tail of the child element:
             if child.tail is not None:
                 out_child.tail = self.format_text(child.tail)
-            else:
+            #Only elements in the whitespace table can receive a pretty-printing tail:
+            elif out_child.tag in self.pretty_print_whitespace:
                 self.add_pretty_print_tail(out_child)
         return out_xml
@@ -17,17 +17,38 @@ class tei_segmenter:
     prefix_tags = set([
         'milestone'
     ])
+    """
+    Clark-notation forms of the prefix tags, for direct comparison against element tags.
+    """
+    prefix_clark_tags = frozenset(['{%s}milestone' % tei_ns])
+    """
+    Clark-notation namespace prefix, precomputed once for stripping element tags down to their local names.
+    """
+    tei_prefix = '{%s}' % tei_ns
+    """
+    Clark-notation tags, precomputed once.
+    """
+    text_tag = '{%s}text' % tei_ns
+    body_tag = '{%s}body' % tei_ns
+    seg_tag = '{%s}seg' % tei_ns
     def __init__(self, **params):
         self.ignored_tag_set = params['t']
+        #Precompute the Clark-notation forms of the ignored tags for direct comparison against element tags:
+        self.ignored_clark_tag_set = set('{%s}%s' % (self.tei_ns, ignored_tag) for ignored_tag in self.ignored_tag_set)
+        #Cache of local names for substantive tags, computed once per distinct tag:
+        self.raw_tags = {}
+        #Cache of positioning values by tag, populated lazily as tags are first classified:
+        self.tag_positions = {}
     """
     Segments the given normalized TEI XML tree, grouping all ignored elements with substantive elements.
     The segments will be labeled with the tag and numerical index of the substantive element.
     """
     def segment(self, xml):
-        #Get the <text/> element in the XML tree:
-        text = xml.xpath('//tei:text', namespaces={'tei': self.tei_ns})[0]
-        #Get the <body/> element under it:
-        body = text.xpath('.//tei:body', namespaces={'tei': self.tei_ns})[0]
+        #Get the <text/> element in the XML tree and the <body/> element under it;
+        #both are direct children of their parents, so a single-level find avoids
+        #the full-document scan that a //-prefixed XPath query would perform:
+        text = xml.find(self.text_tag) if et.iselement(xml) else xml.getroot().find(self.text_tag)
+        body = text.find(self.body_tag)
         #Create a new element to replace it, which we'll populate with segmented content:
         segmented_body = et.Element('{%s}body' % self.tei_ns)
         #Maintain a Dictionary of current substantive element indices:
@@ -37,13 +58,27 @@ class tei_segmenter:
         segment_type = '' #the tag of the substantive element in the current segment:
         segment_n = '' #the index of the substantive element in the current segment:
         pos = 1 #current positioning state (-1 = previous, 0 = current, 1 = next)
-        for child in body.getchildren():
-            raw_tag = child.tag.replace('{%s}' % self.tei_ns, '')
-            #By default, tags will have positioning values of -1:
-            child_pos = -1
-            #If this is a substantive tag, then its positioning value is 0:
-            if raw_tag not in self.ignored_tag_set:
-                child_pos = 0
+        for child in body:
+            tag = child.tag
+            #Look up the positioning value for this tag (0 = substantive, 1 = prefix, -1 = suffix),
+            #classifying each distinct tag only once:
+            child_pos = self.tag_positions.get(tag)
+            if child_pos is None:
+                if tag not in self.ignored_clark_tag_set:
+                    child_pos = 0
+                elif tag in self.prefix_clark_tags:
+                    child_pos = 1
+                else:
+                    child_pos = -1
+                self.tag_positions[tag] = child_pos
+            #If this is a substantive tag, then update the segment bookkeeping:
+            if child_pos == 0:
+                #Get the local name of this tag, which labels the segment; it is computed
+                #once per distinct tag and cached:
+                raw_tag = self.raw_tags.get(tag)
+                if raw_tag is None:
+                    raw_tag = tag.replace(self.tei_prefix, '')
+                    self.raw_tags[tag] = raw_tag
                 #Increment the latest index for this element's tag:
                 if raw_tag not in substantive_indices:
                     substantive_indices[raw_tag] = 0
@@ -54,22 +89,19 @@ class tei_segmenter:
                 if segment_type == '':
                     segment_type = raw_tag
                     segment_n = str(substantive_indices[raw_tag])
-            #Otherwise, if it is a prefix tag, then its positioning value is 1:
-            elif raw_tag in self.prefix_tags:
-                child_pos = 1
             #If its positioning value is greater than the last element's positioning value, or if both are zero, 
             #then add a new segment and move all of the current elements in the queue to it:
             if child_pos > pos or (child_pos == 0 and pos == 0):
                 seg = et.Element('{%s}seg' % self.tei_ns)
                 seg.set('type', segment_type)
                 seg.set('n', segment_n)
-                for segment_element in segment_elements:
-                    seg.append(segment_element)
+                #Move the queued elements into the segment in one bulk operation:
+                seg.extend(segment_elements)
                 segmented_body.append(seg)
                 segment_elements = []
                 #Then reset the segment tag and index to empty values, 
                 #or to the values of the current element if it is substantive:
-                if raw_tag not in self.ignored_tag_set:
+                if child_pos == 0:
                     segment_type = raw_tag
                     segment_n = str(substantive_indices[raw_tag])
                 else:
@@ -84,8 +116,8 @@ class tei_segmenter:
             seg = et.Element('{%s}seg' % self.tei_ns)
             seg.set('type', segment_type)
             seg.set('n', segment_n)
-            for segment_element in segment_elements:
-                seg.append(segment_element)
+            #Move the queued elements into the segment in one bulk operation:
+            seg.extend(segment_elements)
             segmented_body.append(seg)
         #Finally, remove the old body from the XML and replace it with the segmented body:
         text.remove(body)
@@ -95,17 +127,19 @@ class tei_segmenter:
     Desegments a segmented TEI XML tree.
     """
     def desegment(self, xml):
-        #Get the <text/> element in the XML tree:
-        text = xml.xpath('//tei:text', namespaces={'tei': self.tei_ns})[0]
-        #Get the <body/> element under it:
-        body = text.xpath('.//tei:body', namespaces={'tei': self.tei_ns})[0]
+        #Get the <text/> element in the XML tree and the <body/> element under it;
+        #both are direct children of their parents, so a single-level find avoids
+        #the full-document scan that a //-prefixed XPath query would perform:
+        text = xml.find(self.text_tag) if et.iselement(xml) else xml.getroot().find(self.text_tag)
+        body = text.find(self.body_tag)
         #Create a new element to replace it, which we'll populate with desegmented content:
         desegmented_body = et.Element('{%s}body' % self.tei_ns)
-        #For each segment element that is a child of the original body, copy its children as children of the desegmented body:
-        for child in body.getchildren():
-            if child.tag.replace('{%s}' % self.tei_ns, '') == 'seg':
-                for segment_element in child.getchildren():
-                    desegmented_body.append(segment_element)
+        #For each segment element that is a child of the original body, copy its children as children of the desegmented body;
+        #children are re-parented during the walk, so iterate over a snapshot of them:
+        for child in list(body):
+            if child.tag == self.seg_tag:
+                #Move the segment's children into the desegmented body in one bulk operation:
+                desegmented_body.extend(child)
             else:
                 desegmented_body.append(child)
         #Finally, remove the old body from the XML and replace it with the desegmented body:
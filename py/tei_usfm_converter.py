@@ -104,6 +104,17 @@ sbl_abbrevations = {
 Class for converting a transcription (including collation data) in TEI XML format to USFM format.
 """
 class tei_usfm_converter:
+    """
+    Precompiled regular expression for the post-processing pass that moves open section
+    paragraph breaks before new chapters to a position after the new chapters
+    """
+    post_re = re.compile(r"\\p\s*\\c (\d+)\s*\\m")
+    """
+    Precompiled regular expressions for the post-processing passes that collapse
+    runs of superfluous line breaks and spaces left behind by the conversion
+    """
+    collapse_newlines_re = re.compile("\n{2,}")
+    collapse_spaces_re = re.compile(" {2,}")
     def __init__(self, **kwargs):
         # Populate a String referring to the book's filename base:
         self.filebase = kwargs["filebase"] if "filebase" in kwargs else ""
@@ -114,138 +125,274 @@ class tei_usfm_converter:
         # Initialize counters for the current chapter and verse:
         self.chapter_n = ""
         self.verse_n = ""
-        # Initialize a flag indicating whether or not we're currently processing an apparatus entry:
-        self.app_flag = False
+        # Initialize a cache of rendered witness blocks, keyed by "wit" attribute values;
+        # the same combinations of witnesses recur across thousands of variation units:
+        self.wit_usfm_cache = {}
         return
         
     """
-    Recursively converts a transcription (including collation data) in TEI XML format to USFM format.
+    Start-event handler for container elements (TEI, teiHeader, fileDesc, titleStmt, text, body):
+    these contribute nothing themselves, so the walk simply descends into their children.
+    """
+    def start_container(self, elem):
+        return
+    """
+    Start-event handler for title elements: extract the English book title
+    and print the appropriate ID, header, and TOC macros.
+    """
+    def start_title(self, elem):
+        title_text = elem.text
+        if "A collation of" in title_text:
+            long_book_name = title_text.replace("A collation of ", "").replace(" in SR", "")
+            usfm_abbreviation = usfm_abbrevations[long_book_name]
+            sbl_abbreviation = sbl_abbrevations[long_book_name]
+            parts = self.parts
+            parts.append("\\id %s - Solid Rock Hebrew Bible\n" % usfm_abbreviation)
+            parts.append("\\h %s\n" % long_book_name)
+            parts.append("\\toc1 The Book of %s\n" % long_book_name)
+            parts.append("\\toc2 %s\n" % long_book_name)
+            parts.append("\\toc3 %s\n" % sbl_abbreviation)
+        return
+    """
+    Start-event handler for milestone elements in the main text: print a chapter or verse reference.
+    """
+    def start_milestone(self, elem):
+        parts = self.parts
+        unit = elem.get("unit")
+        # If this is an incipit, then add a \mt macro for the main title:
+        if unit == "incipit":
+            parts.append("\\mt ")
+        # If it is a new chapter, then add a new line followed by a \c macro followed by the chapter number:
+        if unit == "chapter":
+            n = elem.get("n")
+            if n is not None:
+                self.chapter_n = n.split("K", 1)[1]
+                parts.append("\n\\c %s" % self.chapter_n)
+                # Add a no-indent paragraph after it:
+                parts.append("\n\\m")
+        # If it is a new verse, then add a \v macro followed by the verse number:
+        if unit == "verse":
+            n = elem.get("n")
+            if n is not None:
+                self.verse_n = n.split("V", 1)[1]
+                parts.append("\n\\v %s " % self.verse_n)
+        return
+    """
+    Start-event handler for milestone elements within a variant reading:
+    chapter and verse numbers are set in bold rather than starting new chapters or verses.
+    """
+    def start_milestone_app(self, elem):
+        parts = self.parts
+        unit = elem.get("unit")
+        # If this is an incipit, then add a \mt macro for the main title:
+        if unit == "incipit":
+            parts.append("\\mt ")
+        # If it is a new chapter, then add a \bd macro followed by the chapter number:
+        if unit == "chapter":
+            n = elem.get("n")
+            if n is not None:
+                self.chapter_n = n.split("K", 1)[1]
+                parts.append("\\bd %s:\\bd*" % self.chapter_n)
+        # If it is a new verse, then add a \bd macro followed by the verse number:
+        if unit == "verse":
+            n = elem.get("n")
+            if n is not None:
+                self.verse_n = n.split("V", 1)[1]
+                parts.append("\\bd %s\\bd* " % self.verse_n)
+        return
+    """
+    Start-event handler for pb elements: these are page breaks (intended to separate "books" of the Psalms).
+    """
+    def start_pb(self, elem):
+        self.parts.append("\n\\pb\n")
+        return
+    """
+    Start-event handler for lb elements in the main text: those with type "open" are open section markers.
+    """
+    def start_lb(self, elem):
+        #None never compares equal to the type string, so a single fetch suffices:
+        if elem.get("type") == "open":
+            self.parts.append("{\u05e4}\n\\p\n")
+        return
+    """
+    Start-event handler for lb elements within a variant reading: the open section marker
+    is printed without a paragraph break.
+    """
+    def start_lb_app(self, elem):
+        #None never compares equal to the type string, so a single fetch suffices:
+        if elem.get("type") == "open":
+            self.parts.append("{\u05e4} ")
+        return
+    """
+    Start-event handler for space elements: those with type "closed" are closed section markers.
+    The closed section marker is rendered the same way inside and outside of variant readings,
+    so this handler is shared by both dispatch tables.
+    """
+    def start_space(self, elem):
+        #None never compares equal to the type string, so a single fetch suffices:
+        if elem.get("type") == "closed":
+            self.parts.append("{\u05e1} ")
+        return
+    """
+    Start-event handler for app elements: open a frame for the apparatus entry;
+    its lemma and readings are rendered directly into the output List
+    as the walk passes through them, and its footnote is closed when the walk exits it.
+    """
+    def start_app(self, elem):
+        app_type = elem.get("type")
+        if app_type is None:
+            app_type = "substantive"
+        # Then process the apparatus entry if necessary:
+        if app_type not in self.ignored_app_types:
+            # If this variation unit's type is not an ignored type, then add a footnote marker
+            # and prefix the apparatus entry by the current verse reference
+            # and the appropriate variant type marker:
+            parts = self.parts
+            parts.append("\\f - \\fr %s:%s \\ft " % (self.chapter_n, self.verse_n))
+            if app_type == "addition":
+                parts.append("\u2e06 ")
+            elif app_type == "transposition":
+                parts.append("\u2e0a ")
+            elif app_type == "omission":
+                parts.append("\u2e0b ")
+            else:
+                parts.append("\u2e03 ")
+        self.app_stack.append([elem, app_type, len(self.parts), "", False])
+        return
+    """
+    Start-event handler for w elements: print the word's text, followed by a space.
+    """
+    def start_w(self, elem):
+        self.parts.append(elem.text + " ")
+        return
+    """
+    Dispatch table mapping local tag names to their start-event handlers;
+    a single Dictionary lookup replaces the cascade of tag comparisons
+    that would otherwise be evaluated for every element
+    """
+    start_handlers = {
+        "TEI": start_container,
+        "teiHeader": start_container,
+        "fileDesc": start_container,
+        "titleStmt": start_container,
+        "text": start_container,
+        "body": start_container,
+        "title": start_title,
+        "milestone": start_milestone,
+        "pb": start_pb,
+        "lb": start_lb,
+        "space": start_space,
+        "app": start_app,
+        "w": start_w
+    }
+    """
+    Variant of the dispatch table used within readings, where chapters, verses,
+    and open section markers are rendered differently; swapping tables on entering
+    and leaving a reading removes the per-element check of an apparatus flag
+    from the handlers themselves
+    """
+    app_start_handlers = dict(start_handlers, milestone=start_milestone_app, lb=start_lb_app)
+    """
+    Converts a transcription (including collation data) in TEI XML format to USFM format.
+    The tree is traversed with a single iterative walk driven by lxml's iterwalk,
+    which avoids the per-element Python call overhead that recursion would incur;
+    the output is accumulated in a List of chunks that is joined once at the end.
     """
     def to_usfm(self, xml):
-        usfm = ""
-        # If the input is an XML tree and not an element, then return the serialization of its root element:
-        if not et.iselement(xml):
-            usfm += self.to_usfm(xml.getroot())
-            # Post-process this USFM text, moving open section paragraph breaks before new chapters to a position after the new chapters
-            # and removing superfluous line breaks and spaces:
-            usfm = re.sub(r"\\p\s*\\c (\d+)\s*\\m", r"\\c \1\n\\p", usfm)
-            usfm = usfm.replace("\n\n", "\n")
-            usfm = usfm.replace("  ", " ")
-            return usfm
-        # Otherwise, proceed according to the tag of the current element:
-        raw_tag = xml.tag.replace("{%s}" % tei_ns, "")
-        # If this element is a TEI, teiHeader, fileDesc, titleStmt, text, body or lem element, then process its children recursively:
-        if raw_tag in ["TEI", "teiHeader", "fileDesc", "titleStmt", "text", "body", "lem"]:
-            for child in xml:
-                usfm += self.to_usfm(child)
-        # If this element is a title, then extract the English book title from it
-        # and print the appropriate ID, header, and TOC macros:
-        if raw_tag == "title":
-            title_text = xml.text
-            if "A collation of" in title_text:
-                long_book_name = title_text.replace("A collation of ", "").replace(" in SR", "")
-                usfm_abbreviation = usfm_abbrevations[long_book_name]
-                sbl_abbreviation = sbl_abbrevations[long_book_name]
-                usfm += "\\id %s - Solid Rock Hebrew Bible\n" % usfm_abbreviation
-                usfm += "\\h %s\n" % long_book_name
-                usfm += "\\toc1 The Book of %s\n" % long_book_name
-                usfm += "\\toc2 %s\n" % long_book_name
-                usfm += "\\toc3 %s\n" % sbl_abbreviation
-        # If this element is a milestone, then print a chapter or verse
-        if raw_tag == "milestone":
-            unit = xml.get("unit")
-            # If this is an incipit, then add a \mt macro for the main title:
-            if unit == "incipit":
-                usfm += "\\mt "
-            # If it is a new chapter, then add a new line followed by a \c macro (or a \bd macro, if we're in a variant reading) followed by the chapter number:
-            if unit == "chapter":
-                if xml.get("n") is not None:
-                    self.chapter_n = xml.get("n").split("K")[1]
-                    if self.app_flag:
-                        usfm += "\\bd %s:\\bd*" % self.chapter_n
-                    else:
-                        usfm += "\n\\c %s" % self.chapter_n
-                        # Add a no-indent paragraph after it:
-                        usfm += "\n\\m"
-            # If it is a new verse, then add a \v macro (or a \bd macro, if we're in a variant reading) followed by the verse number:
-            if unit == "verse":
-                if xml.get("n") is not None:
-                    self.verse_n = xml.get("n").split("V")[1]
-                    if self.app_flag:
-                        usfm += "\\bd %s\\bd* " % self.verse_n
-                    else:
-                        usfm += "\n\\v %s " % self.verse_n
-        # If this element is a pb element, then it is a page break (intended to separate "books" of the Psalms):
-        if raw_tag == "pb":
-            usfm += "\n\\pb\n"
-        # If this element is a lb element with type "open", then it is an open section marker:
-        if raw_tag == "lb":
-            if xml.get("type") is not None and xml.get("type") == "open":
-                if self.app_flag:
-                    usfm += "{\u05e4} "
+        # If the input is an XML tree and not an element, then serialize its root element:
+        root = xml if et.iselement(xml) else xml.getroot()
+        # Maintain a List of output chunks to be joined once at the end;
+        # it is kept on the instance so that the tag handlers can reach it:
+        self.parts = parts = []
+        # Maintain a stack of frames for open app elements, each consisting of
+        # the element itself, its type, the offset in the output List where the
+        # current lemma or reading began, the captured lemma text, and a flag
+        # indicating whether a reading has been rendered yet:
+        self.app_stack = app_stack = []
+        # Bind the dispatch table locally, as it is consulted for every element;
+        # within a reading, it is swapped for the variant table:
+        start_handlers = self.start_handlers
+        walker = et.iterwalk(root, events=("start", "end"))
+        for event, elem in walker:
+            # Strip the namespace from the tag with a single scan from its end,
+            # rather than rebuilding the namespace prefix and scanning for it on every element:
+            raw_tag = elem.tag.rpartition("}")[2]
+            if event == "start":
+                # Within an app element, only the lemma and the readings are rendered,
+                # and readings of ignored apparatus types are not rendered at all:
+                if app_stack and elem.getparent() is app_stack[-1][0]:
+                    frame = app_stack[-1]
+                    if raw_tag == "lem":
+                        # If the apparatus entry will be processed, then remember where the lemma's
+                        # rendering begins, so that it can be captured for the main text;
+                        # otherwise, its rendering is already in its final position:
+                        if frame[1] not in self.ignored_app_types:
+                            frame[2] = len(parts)
+                        continue
+                    if raw_tag == "rdg" and frame[1] not in self.ignored_app_types:
+                        # Separate this reading from any previous one with a broken bar:
+                        if frame[4]:
+                            parts.append("\u00a6 ")
+                        frame[4] = True
+                        # Switch to the dispatch table for apparatus entries
+                        # and remember where this reading's rendering begins:
+                        start_handlers = self.app_start_handlers
+                        frame[2] = len(parts)
+                        continue
+                    walker.skip_subtree()
+                    continue
+                # Otherwise, dispatch on the tag:
+                handler = start_handlers.get(raw_tag)
+                if handler is not None:
+                    handler(self, elem)
                 else:
-                    usfm += "{\u05e4}\n\\p\n"
-        # If this element is a space element with type "closed", then it is a closed section marker:
-        if raw_tag == "space":
-            if xml.get("type") is not None and xml.get("type") == "closed":
-                if self.app_flag:
-                    usfm += "{\u05e1} "
-                else:
-                    usfm += "{\u05e1} "
-        # If this element is an app element, then proceed according to its type:
-        if raw_tag == "app":
-            app_type = xml.get("type") if xml.get("type") is not None else "substantive"
-            # Save the current chapter and verse reference, and get the lemma text to be set in the main text later:
-            current_chapter_n = self.chapter_n
-            current_verse_n = self.verse_n
-            lem = xml.find("tei:lem", namespaces={"tei": tei_ns})
-            lem_usfm = self.to_usfm(lem)
-            # Then process the apparatus entry if necessary:
-            if app_type not in self.ignored_app_types:
-                # If this variation unit's type is not an ignored type, then add a text-critical footnote 
-                # and surround the lemma with the appropriate marks in the main text.
-                # Set the flag for processing apparatus entries:
-                self.app_flag = True
-                # Add a footnote marker and prefix the apparatus entry by the verse reference 
-                # and the appropriate variant type marker:
-                usfm += "\\f - \\fr %s:%s \\ft " % (current_chapter_n, current_verse_n)
-                if app_type == "addition":
-                    usfm += "\u2e06 "
-                elif app_type == "transposition":
-                    usfm += "\u2e0a "
-                elif app_type == "omission":
-                    usfm += "\u2e0b "
-                else:
-                    usfm += "\u2e03 "
-                # Then recursively parse the contents of the readings, separated by broken bars:
-                usfm += "\u00a6 ".join([self.to_usfm(rdg) for rdg in xml.findall("tei:rdg", namespaces={"tei": tei_ns})])
-                # Then close the footnote and turn off the flag for processing apparatus entries:
-                usfm += "\\f*"
-                self.app_flag = False
-                # Add the appropriate critical marks around the lemma text:
-                if app_type == "addition":
-                    usfm += "\u2e06 "
-                elif app_type == "transposition":
-                    usfm += "\u2e0a %s\u2e09 " % lem_usfm
-                elif app_type == "omission":
-                    usfm += "\u2e0b %s\u2e0c " % lem_usfm
-                else:
-                    usfm += "\u2e03 %s\u2e02 " % lem_usfm
-            else:
-                # If this variation unit's type is an ignored type, then just print the lemma text:
-                usfm += lem_usfm
-        # If this element is a rdg element, then print its contents recursively and then print its witnesses in a \fw block:
-        if raw_tag == "rdg":
-            rdg_usfm = ""
-            for child in xml:
-                rdg_usfm += self.to_usfm(child)
-            # If the reading is empty, then replace it with an en-dash:
-            if rdg_usfm == "":
-                rdg_usfm = "\u2013 "
-            usfm += rdg_usfm
-            usfm += "\\fw %s \\fw* " % (" ".join([self.wit_sigla[wit] for wit in xml.get("wit").split()]))
-        # If this element is a w element, then print its text, followed by a space:
-        if raw_tag == "w":
-            usfm += xml.text + " "
-        # Finally, return the parsed USFM text:
-        return usfm
\ No newline at end of file
+                    # Elements with no handler contribute nothing to the USFM text, so skip their subtrees:
+                    walker.skip_subtree()
+                continue
+            # On exit from an app element, close its footnote and set the lemma text in the main text:
+            if raw_tag == "app":
+                frame = app_stack.pop()
+                app_type = frame[1]
+                lem_usfm = frame[3]
+                # If this variation unit's type is an ignored type, then its lemma text is already in place:
+                if app_type not in self.ignored_app_types:
+                    # Close the footnote:
+                    parts.append("\\f*")
+                    # Add the appropriate critical marks around the lemma text:
+                    if app_type == "addition":
+                        parts.append("\u2e06 ")
+                    elif app_type == "transposition":
+                        parts.append("\u2e0a %s\u2e09 " % lem_usfm)
+                    elif app_type == "omission":
+                        parts.append("\u2e0b %s\u2e0c " % lem_usfm)
+                    else:
+                        parts.append("\u2e03 %s\u2e02 " % lem_usfm)
+                continue
+            # On exit from a lemma or reading, capture its rendered text out of the output List:
+            if app_stack and elem.getparent() is app_stack[-1][0]:
+                frame = app_stack[-1]
+                if raw_tag == "lem":
+                    if frame[1] not in self.ignored_app_types:
+                        frame[3] = "".join(parts[frame[2]:])
+                        del parts[frame[2]:]
+                elif raw_tag == "rdg" and frame[1] not in self.ignored_app_types:
+                    # If the reading is empty, then replace it with an en-dash:
+                    if len(parts) == frame[2]:
+                        parts.append("\u2013 ")
+                    # Then add its witnesses in a \fw block, rendering it only the first time
+                    # this combination of witnesses is encountered:
+                    wit_refs = elem.get("wit")
+                    wit_usfm = self.wit_usfm_cache.get(wit_refs)
+                    if wit_usfm is None:
+                        wit_usfm = "\\fw %s \\fw* " % (" ".join([self.wit_sigla[wit] for wit in wit_refs.split()]))
+                        self.wit_usfm_cache[wit_refs] = wit_usfm
+                    parts.append(wit_usfm)
+                    # Switch back to the main dispatch table:
+                    start_handlers = self.start_handlers
+        usfm = "".join(parts)
+        # Post-process this USFM text, moving open section paragraph breaks before new chapters to a position after the new chapters
+        # and removing superfluous line breaks and spaces:
+        usfm = self.post_re.sub(r"\\c \1\n\\p", usfm)
+        usfm = self.collapse_newlines_re.sub("\n", usfm)
+        usfm = self.collapse_spaces_re.sub(" ", usfm)
+        return usfm
@@ -2,7 +2,6 @@
 
 import argparse, os
 from lxml import etree as et
-import re
 import unicodedata as ud
 
 """
@@ -11,6 +10,19 @@ XML namespaces
 XML_NS = 'http://www.w3.org/XML/1998/namespace'
 TEI_NS = 'http://www.tei-c.org/ns/1.0'
 
+"""
+Clark-notation tag and attribute strings, precomputed once at module load
+"""
+TEI_TEI_TAG = '{%s}TEI' % TEI_NS
+TEI_TEIHEADER_TAG = '{%s}teiHeader' % TEI_NS
+TEI_FILEDESC_TAG = '{%s}fileDesc' % TEI_NS
+TEI_TITLESTMT_TAG = '{%s}titleStmt' % TEI_NS
+TEI_TITLE_TAG = '{%s}title' % TEI_NS
+TEI_PUBLICATIONSTMT_TAG = '{%s}publicationStmt' % TEI_NS
+TEI_SOURCEDESC_TAG = '{%s}sourceDesc' % TEI_NS
+TEI_TEXT_TAG = '{%s}text' % TEI_NS
+XML_LANG_ATTR = '{%s}lang' % XML_NS
+
 """
 Book index-to-book name Dictionary.
 """
@@ -57,259 +69,250 @@ BOOK_NAMES = {
 }
 
 """
-Regular expressions
+Set of trailing punctuation characters (maqaf, paseq, sof pasuq, nun hafukha, geresh, gershayim)
+"""
+TRAILING_PUNC_CHARS = frozenset('\u05BE\u05C0\u05C3\u05C6\u05F3\u05F4')
+
+"""
+Translation table that deletes the forward slashes separating prefixes and suffixes from word roots
 """
-FILENAME_REGEX = re.compile('(\d+)_(.*).xml')
-PUNC_REGEX = re.compile('([\u0591-\u05BD\u05BF\u05C1-\u05C2\u05C4-\u05C5\u05C7\u05D0-\u05F2\u200C-\u200D\uFB1D-\uFB1F\uFB2A-\uFB4E]*)([\u05BE\u05C0\u05C3\u05C6\u05F3-\u05F4]*)')
+SLASH_DELETION_TABLE = str.maketrans('', '', '/')
+
+"""
+Cache of normalized words, keyed by their raw forms; the same word forms recur
+many times over a whole book, so each distinct form only needs to be normalized once
+"""
+NORMALIZATION_CACHE = {}
+
+def collect_word_text(child):
+    """
+    Given a word-bearing XML element, collects its text along with any letters contributed by its child elements.
+    """
+    text = child.text if child.text is not None else ''
+    for grandchild in child:
+        #If this word contains stylized letters in a child <s/> element, then append them to this word:
+        if grandchild.tag == 's':
+            text += grandchild.text
+            if grandchild.tail is not None:
+                text += grandchild.tail.strip()
+        #If this word contains a note in a child <x/> element, then append any trailing letters to this word:
+        elif grandchild.tag == 'x':
+            if grandchild.tail is not None:
+                text += grandchild.tail.strip()
+    return text
 
-def word_to_xml(word):
+def word_to_xml(parent, word):
     """
-    Given a unicode String representing a single word and any surrounding punctuation, parse it to a List of XML <w/> and <pc/> elements.
+    Given a parent XML element and a unicode String representing a single word and any surrounding punctuation,
+    parse it to XML <w/> and <pc/> elements appended directly under the parent.
     """
-    xml = []
-    #Normalize the word:
-    normalized = word
-    normalized = normalized.replace('/', '') #remove forward slashes separating prefixes and suffixes from word roots
-    normalized = ud.normalize('NFC', normalized) #convert decomposed unicode characters to precomposed unicode characters
-    #Then separate the word from its trailing punctuation:
-    groups = PUNC_REGEX.match(normalized).groups()
-    word_text = groups[0]
-    trailing_punc = groups[1]
+    #Normalize the word, reusing the cached result if this form has been seen before:
+    normalized = NORMALIZATION_CACHE.get(word)
+    if normalized is None:
+        normalized = word.translate(SLASH_DELETION_TABLE) #remove forward slashes separating prefixes and suffixes from word roots
+        normalized = ud.normalize('NFC', normalized) #convert decomposed unicode characters to precomposed unicode characters
+        NORMALIZATION_CACHE[word] = normalized
+    #Then separate the word from its trailing punctuation,
+    #scanning backward over the (usually empty or single-character) run of trailing punctuation marks
+    #rather than matching the entire word against a regular expression:
+    i = len(normalized)
+    while i > 0 and normalized[i - 1] in TRAILING_PUNC_CHARS:
+        i -= 1
+    word_text = normalized[:i]
+    trailing_punc = normalized[i:]
     #Process the word itself:
     if word_text != '':
-        w = et.Element('w')
+        w = et.SubElement(parent, 'w')
         w.text = word_text
         w.tail = '' #add an empty tail to ensure printing on the same line
-        xml.append(w)
     #Process any trailing punctuation:
     if trailing_punc != '':
         #Create an element for each trailing punctuation mark separately:
-        for punc in list(trailing_punc):
-            pc = et.Element('pc')
+        for punc in trailing_punc:
+            pc = et.SubElement(parent, 'pc')
             pc.text = punc
             pc.tail = '' #add an empty tail to ensure printing on the same line
-            xml.append(pc)
-    return xml
+    return
 
 def wlc_to_itsee(input_addr, output_addr):
     """
     Given the address of an input .xml file in WLC TEI format, reformats and writes the TEI XML to a file with the output address according to ITSEE guidelines.
     """
     print('Parsing text from %s to %s...' % (input_addr, output_addr))
-    #Open the input XML tree to be read:
-    parser = et.XMLParser(remove_blank_text=True)
-    input_tei = et.parse(input_addr, parser=parser)
-    #Get the index of the book we'll be writing to:
-    match = FILENAME_REGEX.match(os.path.basename(input_addr))
-    if match is None or len(match.groups()) < 2 or match.groups()[0] not in BOOK_NAMES:
+    #Get the index of the book we'll be writing to;
+    #the file name has the simple form {book_number}_{witness_id}.xml, so plain string operations suffice to parse it:
+    base_parts = os.path.splitext(os.path.basename(input_addr))[0].split('_', 1)
+    if len(base_parts) != 2 or base_parts[0] not in BOOK_NAMES:
         print('The input file name is expected to represent the index of the book (e.g., "01_WLC.xml" for Genesis in the WLC).')
         exit(-1)
-    wit_ind = match.groups()[1]
-    book_ind = match.groups()[0]
+    book_ind = base_parts[0]
+    wit_ind = base_parts[1]
     #Now we'll begin constructing the XML tree to be output.
     #First, define the namespace to use:
     nsmap={None: TEI_NS}
     #Under this, add a <TEI/> element to be populated later:
-    tei = et.Element('{%s}TEI' % TEI_NS, nsmap=nsmap)
+    tei = et.Element(TEI_TEI_TAG, nsmap=nsmap)
     #First, add a <teiHeader/> element under the TEI element:
-    teiHeader = et.Element('{%s}teiHeader' % TEI_NS)
-    tei.append(teiHeader)
+    teiHeader = et.SubElement(tei, TEI_TEIHEADER_TAG)
     #Under this, add a <fileDesc/> element:
-    fileDesc = et.Element('{%s}fileDesc' % TEI_NS)
-    teiHeader.append(fileDesc)
+    fileDesc = et.SubElement(teiHeader, TEI_FILEDESC_TAG)
     #Under this, add a <titleStmt/> element:
-    titleStmt = et.Element('{%s}titleStmt' % TEI_NS)
-    fileDesc.append(titleStmt)
+    titleStmt = et.SubElement(fileDesc, TEI_TITLESTMT_TAG)
     #Under this, add a <title/> element:
-    title = et.Element('{%s}title' % TEI_NS)
+    title = et.SubElement(titleStmt, TEI_TITLE_TAG)
     title.text = 'A transcription of %s in %s' % (BOOK_NAMES[book_ind], wit_ind)
-    titleStmt.append(title)
     #Next, add a <title/> element for the document ID:
-    title_document = et.Element('{%s}title' % TEI_NS)
+    title_document = et.SubElement(titleStmt, TEI_TITLE_TAG)
     title_document.set('type', 'document')
     title_document.set('n', wit_ind)
     title_document.text = wit_ind
-    titleStmt.append(title_document)
     #Next, add a <publicationStmt/> element under the fileDesc:
-    publicationStmt = et.Element('{%s}publicationStmt' % TEI_NS)
-    p = et.Element('p')
+    publicationStmt = et.SubElement(fileDesc, TEI_PUBLICATIONSTMT_TAG)
+    p = et.SubElement(publicationStmt, 'p')
     p.text = 'Temporary publicationStmt for validation'
-    publicationStmt.append(p)
-    fileDesc.append(publicationStmt)
     #Next, add a <sourceDesc/> element under the fileDesc:
-    sourceDesc = et.Element('{%s}sourceDesc' % TEI_NS)
-    p = et.Element('p')
+    sourceDesc = et.SubElement(fileDesc, TEI_SOURCEDESC_TAG)
+    p = et.SubElement(sourceDesc, 'p')
     p.text = 'Temporary sourceDesc for validation'
-    sourceDesc.append(p)
-    fileDesc.append(sourceDesc)
     #Then, add a <text/> element under the TEI element:
-    text = et.Element('{%s}text' % TEI_NS)
-    text.set('{%s}lang' % XML_NS, 'he')
-    tei.append(text)
+    text = et.SubElement(tei, TEI_TEXT_TAG)
+    text.set(XML_LANG_ATTR, 'he')
     #Under this, add a <body/> element:
-    body = et.Element('body')
-    text.append(body)
+    body = et.SubElement(text, 'body')
     #Add a <div/> element for the book under the body element:
     book_n = 'B' + book_ind
-    book = et.Element('div')
+    book = et.SubElement(body, 'div')
     book.set('type', 'book')
     book.set('n', book_n)
-    body.append(book)
-    #Add a <div/> element for the incipit using the book's Hebrew name:
-    hebrewname = input_tei.xpath('//hebrewname')[0]
-    incipit_n = book_n + 'incipit'
-    incipit = et.Element('div')
-    incipit.set('type', 'incipit')
-    incipit.set('n', incipit_n)
-    book.append(incipit)
-    verse = et.Element('ab')
-    words = hebrewname.text.split()
-    for word in words:
-        els = word_to_xml(word)
-        for el in els:
-            verse.append(el)
-    #Add a line break at the end of the incipit:
-    lb = et.Element('lb')
-    verse.append(lb)
-    incipit.append(verse)
-    #Then proceed for each element in the file:
+    #Then proceed for each element of interest as it is parsed from the input file;
+    #streaming the parse instead of materializing the whole input tree keeps
+    #no more than a chapter of the input resident at a time:
     chapter_n = ''
     chapter = None
+    incipit_added = False
     verse_n = ''
+    last_v_n = None #raw verse number of the last <ab/> element added
     verse = None
     app = None
     rdg = None
     ketiv_toggle = False
     qere_toggle = False
-    for child in input_tei.getiterator():
+    #Only the tags handled below are of interest; filtering them in lxml's C-level
+    #parser avoids a Python-level pass over every other element in the tree.
+    #Chapters and verses are handled on their start events, so that they are processed
+    #before their contents; word-level elements are handled on their end events,
+    #so that their children are available:
+    for event, child in et.iterparse(input_addr, events=('start', 'end'), tag=('hebrewname', 'c', 'v', 'k', 'q', 'w', 'pe', 'samekh'), remove_blank_text=True):
+        if event == 'start':
+            if child.tag not in ('c', 'v'):
+                continue
+        elif child.tag == 'c':
+            #The end of a chapter means that all of its contents have been processed,
+            #so release it and any previously parsed siblings from memory:
+            child.clear()
+            while child.getprevious() is not None:
+                del child.getparent()[0]
+            continue
+        elif child.tag == 'v':
+            continue
+        elif child.tag == 'hebrewname':
+            #Only the first hebrewname element names the book; ignore any later occurrences:
+            if incipit_added:
+                continue
+            incipit_added = True
+            #Add a <div/> element for the incipit using the book's Hebrew name:
+            incipit_n = book_n + 'incipit'
+            incipit = et.SubElement(book, 'div')
+            incipit.set('type', 'incipit')
+            incipit.set('n', incipit_n)
+            verse = et.SubElement(incipit, 'ab')
+            words = child.text.split()
+            for word in words:
+                word_to_xml(verse, word)
+            #Add a line break at the end of the incipit:
+            lb = et.SubElement(verse, 'lb')
+            continue
         if child.tag == 'c':
             #This is a new chapter:
             ketiv_toggle = False
             qere_toggle = False
             chapter_n = book_n + 'K' + child.get('n')
-            chapter = et.Element('div')
+            #Restart the verse tracker, since verse numbers begin again with each chapter:
+            last_v_n = None
+            chapter = et.SubElement(book, 'div')
             chapter.set('type', 'chapter')
             chapter.set('n', chapter_n)
-            book.append(chapter)
             continue
         if child.tag == 'v':
             #This is a new verse:
             ketiv_toggle = False
             qere_toggle = False
             #Since multiple documentary sources may exist within the same verse, one verse may be repeated;
-            #only add a new <ab/> element if the verse number changes:
-            new_verse_n = chapter_n + 'V' + child.get('n')
-            if new_verse_n != verse_n:
-                verse_n = new_verse_n
-                verse = et.Element('ab')
+            #only add a new <ab/> element if the verse number changes.
+            #Comparing the raw verse number avoids rebuilding the composite reference for repeated verses:
+            v_n = child.get('n')
+            if v_n != last_v_n:
+                last_v_n = v_n
+                verse_n = chapter_n + 'V' + v_n
+                verse = et.SubElement(chapter, 'ab')
                 verse.set('n', verse_n)
-                chapter.append(verse)
             continue
         if child.tag == 'k':
             #This is a word of a ketiv reading; create new <app/> and <rdg/> elements, if we haven't already:
             qere_toggle = False
             if not ketiv_toggle:
                 ketiv_toggle = True
-                app = et.Element('app')
-                verse.append(app)
-                rdg = et.Element('rdg')
+                app = et.SubElement(verse, 'app')
+                rdg = et.SubElement(app, 'rdg')
                 rdg.set('type', 'ketiv')
-                app.append(rdg)
             #Check for any child elements included within the word:
-            text = child.text if child.text is not None else ''
-            for grandchild in child.getchildren():
-                #If this word contains stylized letters in a child <s/> element, then append them to this word:
-                if grandchild.tag == 's':
-                    text += grandchild.text
-                    if grandchild.tail is not None:
-                        text += grandchild.tail.strip()
-                #If this word contains a note in a child <x/> element, then append any trailing letters to this word:
-                if grandchild.tag == 'x':
-                    if grandchild.tail is not None:
-                        text += grandchild.tail.strip()
-            els = word_to_xml(text)
-            for el in els:
-                rdg.append(el)
+            text = collect_word_text(child)
+            word_to_xml(rdg, text)
             continue
         if child.tag == 'q':
             #This is a word of a qere reading; if a ketiv reading was not present before it, then create an <app/> element and an empty <rdg/> element:
             if not ketiv_toggle and not qere_toggle:
                 ketiv_toggle = True
-                app = et.Element('app')
-                verse.append(app)
-                rdg = et.Element('rdg')
+                app = et.SubElement(verse, 'app')
+                rdg = et.SubElement(app, 'rdg')
                 rdg.set('type', 'ketiv')
-                app.append(rdg)
             else:
                 ketiv_toggle = False
             #If a ketiv reading has already been processed, then create a new <rdg/> element, if we haven't already:
             if not qere_toggle:
                 qere_toggle = True
-                rdg = et.Element('rdg')
+                rdg = et.SubElement(app, 'rdg')
                 rdg.set('type', 'qere')
-                app.append(rdg)
             #Check for any child elements included within the word:
-            text = child.text if child.text is not None else ''
-            for grandchild in child.getchildren():
-                #If this word contains stylized letters in a child <s/> element, then append them to this word:
-                if grandchild.tag == 's':
-                    text += grandchild.text
-                    if grandchild.tail is not None:
-                        text += grandchild.tail.strip()
-                #If this word contains a note in a child <x/> element, then append any trailing letters to this word:
-                if grandchild.tag == 'x':
-                    if grandchild.tail is not None:
-                        text += grandchild.tail.strip()
-            els = word_to_xml(text)
-            for el in els:
-                rdg.append(el)
+            text = collect_word_text(child)
+            word_to_xml(rdg, text)
             continue
         if child.tag == 'w':
             #This is a normal word:
             ketiv_toggle = False
             qere_toggle = False
-            text = child.text
+            #Check for any child elements included within the word:
+            text = collect_word_text(child)
             #If multiple documentary sources exist within the same verse, then ignore the placeholders:
             if text == '.':
                 continue
-            #Check for any child elements included within the word:
-            for grandchild in child.getchildren():
-                #If this word contains stylized letters in a child <s/> element, then append them to this word:
-                if grandchild.tag == 's':
-                    text += grandchild.text
-                    if grandchild.tail is not None:
-                        text += grandchild.tail.strip()
-                #If this word contains a note in a child <x/> element, then append any trailing letters to this word:
-                if grandchild.tag == 'x':
-                    if grandchild.tail is not None:
-                        text += grandchild.tail.strip()
             #If the word contains a space followed by punctuation, then remove the space:
             text = text.replace(' ', '')
-            els = word_to_xml(text)
-            for el in els:
-                verse.append(el)
-            continue
-        if child.tag == 's':
-            #Ignore, as we've already processed this:
-            continue
-        if child.tag == 'x':
-            #Ignore, as we've already processed this:
+            word_to_xml(verse, text)
             continue
         if child.tag == 'pe':
             #This is an open section break:
             ketiv_toggle = False
             qere_toggle = False
-            lb = et.Element('lb')
+            lb = et.SubElement(verse, 'lb')
             lb.set('type', 'open')
-            verse.append(lb)
             continue
         if child.tag == 'samekh':
             #This is a closed section break:
             ketiv_toggle = False
             qere_toggle = False
-            space = et.Element('space')
+            space = et.SubElement(verse, 'space')
             space.set('type', 'closed')
-            verse.append(space)
             continue
     #Then clean up the namespaces for the XML:
     et.cleanup_namespaces(tei)